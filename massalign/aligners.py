@@ -1,4 +1,6 @@
 from abc import ABCMeta, abstractmethod
+from bisect import bisect_left, bisect_right
+import copy, time
 import numpy as np
 
 class ParagraphAligner:
@@ -17,6 +19,469 @@ class SentenceAligner:
     def alignSentencesFromParagraphs(self):
         pass
 		
+def getNormalizedText(text):
+	"""
+	Normalises a sentence for exact matching by lowercasing it and collapsing its whitespace.
+	"""
+	return ' '.join(text.lower().split())
+	
+def getExactMatchAnchors(keys1, keys2):
+	"""
+	Finds the pairs of source and target items with the same key that can be aligned without any similarity calculations.
+	Only keys that occur exactly once on each side are considered, and of those, the largest set of pairs that are in the same order on both sides is kept.
+	
+	* *Parameters*:
+		* **keys1**: A list with the key of each source item. Empty keys are never matched.
+		* **keys2**: A list with the key of each target item.
+	* *Output*:
+		* **anchors**: A list of (i, j) pairs of source and target positions, increasing on both sides.
+	"""
+	#Find the keys that are unique on both sides:
+	positions1 = {}
+	for i, key in enumerate(keys1):
+		positions1[key] = -1 if key in positions1 else i
+	positions2 = {}
+	for j, key in enumerate(keys2):
+		positions2[key] = -1 if key in positions2 else j
+	pairs = [(positions1[key], positions2[key]) for key in keys1 if len(key)>0 and positions1[key]>-1 and positions2.get(key, -1)>-1]
+	
+	#Keep the longest chain of pairs that increases on both sides:
+	tails = []
+	tail_pairs = []
+	previous = {}
+	for pair in pairs:
+		k = bisect_left(tails, pair[1])
+		previous[pair] = tail_pairs[k-1] if k>0 else None
+		if k==len(tails):
+			tails.append(pair[1])
+			tail_pairs.append(pair)
+		else:
+			tails[k] = pair[1]
+			tail_pairs[k] = pair
+	anchors = []
+	pair = tail_pairs[-1] if len(tail_pairs)>0 else None
+	while pair is not None:
+		anchors.append(pair)
+		pair = previous[pair]
+	anchors.reverse()
+	return anchors
+	
+def getAlignerWithSettings(aligner, setting):
+	"""
+	Produces a shallow copy of an aligner with some of its parameters replaced, which shares the original's similarity model.
+	
+	* *Parameters*:
+		* **aligner**: An aligner instance.
+		* **setting**: A dictionary connecting the names of parameters of the aligner to their new values.
+	* *Output*:
+		* **aligner**: The copy of the aligner.
+	"""
+	aligner = copy.copy(aligner)
+	for name, value in setting.items():
+		if not hasattr(aligner, name):
+			raise ValueError('Unknown aligner parameter: ' + str(name))
+		setattr(aligner, name, value)
+	return aligner
+	
+def getAnchorGaps(anchors, size1, size2):
+	"""
+	Produces the source and target ranges between consecutive anchors, including the ones before the first and after the last anchor.
+	
+	* *Output*:
+		* **gaps**: A list of (start1, end1, start2, end2) tuples, one before each anchor and one after the last.
+	"""
+	gaps = []
+	start1 = 0
+	start2 = 0
+	for i, j in anchors:
+		gaps.append((start1, i, start2, j))
+		start1 = i+1
+		start2 = j+1
+	gaps.append((start1, size1, start2, size2))
+	return gaps
+	
+class AlignmentBudgetExceeded(Exception):
+	"""
+	Raised when an alignment path search runs out of its AlignmentBudget.
+	"""
+	pass
+		
+class AlignmentBudget:
+	"""
+	Limits the work spent searching for alignment paths. The limits count from the last call to start, so that a budget can be shared by all the searches made for a pair of documents, and None disables a limit.
+	Once the budget runs out, it stays exceeded until the next call to start.
+	
+	* *Parameters*:
+		* **time_limit**: The maximum number of seconds spent in the search.
+		* **max_similarity_evaluations**: The maximum number of similarity scores read or calculated by the search.
+		* **max_synchronizer_scans**: The maximum number of searches for a synchronizer or starting point outside the vicinity of the current coordinate.
+	"""
+	
+	def __init__(self, time_limit=None, max_similarity_evaluations=None, max_synchronizer_scans=None):
+		self.time_limit = time_limit
+		self.max_similarity_evaluations = max_similarity_evaluations
+		self.max_synchronizer_scans = max_synchronizer_scans
+		self.start()
+		
+	def start(self):
+		"""
+		Resets the counters and the clock of the budget.
+		"""
+		self.exceeded = False
+		self.similarity_evaluations = 0
+		self.synchronizer_scans = 0
+		self.deadline = None
+		if self.time_limit is not None:
+			self.deadline = time.time()+self.time_limit
+			
+	def chargeSimilarityEvaluations(self, count=1):
+		"""
+		Records similarity evaluations, and raises an AlignmentBudgetExceeded exception if the budget has run out.
+		"""
+		self.similarity_evaluations += count
+		if self.max_similarity_evaluations is not None and self.similarity_evaluations>self.max_similarity_evaluations:
+			self.exceed('Maximum number of similarity evaluations exceeded: ' + str(self.max_similarity_evaluations))
+		self.checkDeadline()
+		
+	def chargeSynchronizerScan(self):
+		"""
+		Records a synchronizer scan, and raises an AlignmentBudgetExceeded exception if the budget has run out.
+		"""
+		self.synchronizer_scans += 1
+		if self.max_synchronizer_scans is not None and self.synchronizer_scans>self.max_synchronizer_scans:
+			self.exceed('Maximum number of synchronizer scans exceeded: ' + str(self.max_synchronizer_scans))
+		self.checkDeadline()
+	
+	def checkDeadline(self):
+		"""
+		Raises an AlignmentBudgetExceeded exception if the time limit has passed.
+		"""
+		if self.deadline is not None and time.time()>self.deadline:
+			self.exceed('Time limit exceeded: ' + str(self.time_limit))
+	
+	def exceed(self, message):
+		"""
+		Marks the budget as exceeded and raises an AlignmentBudgetExceeded exception with the given message.
+		"""
+		self.exceeded = True
+		raise AlignmentBudgetExceeded(message)
+		
+class AlignmentResult(tuple):
+	"""
+	The output of an aligner, which is unpacked and indexed like any other tuple, and also records whether the search ran out of its budget.
+	
+	* *Parameters*:
+		* **values**: The values of the tuple, such as an alignment path and the pairs of paragraphs or sentences aligned.
+		* **budget_exceeded**: True if the search exceeded its AlignmentBudget, in which case the alignments are partial.
+	"""
+	
+	def __new__(cls, values, budget_exceeded=False):
+		result = tuple.__new__(cls, values)
+		result.budget_exceeded = budget_exceeded
+		return result
+		
+class BudgetedBufferSimilarity:
+	"""
+	Charges every similarity calculated by a buffer similarity object to an AlignmentBudget.
+	
+	* *Parameters*:
+		* **buffer_similarity**: An object that calculates the similarity between buffers of sentences.
+		* **budget**: An AlignmentBudget instance.
+	"""
+	
+	def __init__(self, buffer_similarity, budget):
+		self.buffer_similarity = buffer_similarity
+		self.budget = budget
+		
+	def getSimilarity(self, indexes1, indexes2):
+		self.budget.chargeSimilarityEvaluations()
+		return self.buffer_similarity.getSimilarity(indexes1, indexes2)
+		
+class SynchronizerIndex:
+	"""
+	An index of the acceptable cells of a paragraph similarity matrix, which finds the closest acceptable cell strictly ahead of a coordinate without scanning the matrix.
+	The columns of the acceptable cells are kept sorted per row. The index is built on its first query from the region of the matrix ahead of that query, since the alignment path only moves forward.
+	Rows of which all acceptable cells are behind the column of a query are removed from the search, so queries skip empty regions instead of visiting every row ahead of them.
+	
+	* *Parameters*:
+		* **paragraph_similarities**: A matrix containing a similarity score for each paragraph pair.
+		* **acceptable_similarity**: The minimum similarity score of an acceptable cell.
+		* **budget**: An AlignmentBudget to which each query is charged as a synchronizer scan. If None, queries are not limited.
+	"""
+	
+	def __init__(self, paragraph_similarities, acceptable_similarity, budget=None):
+		self.paragraph_similarities = paragraph_similarities
+		self.acceptable_similarity = acceptable_similarity
+		self.budget = budget
+		self.origin = None
+		self.columns = {}
+		self.rows = []
+		self.next_rows = [0]
+		self.rows_by_last_column = []
+		self.pruned_rows = 0
+		self.pruned_column = -1
+		
+	def build(self, i, j):
+		"""
+		Indexes the acceptable cells from source paragraph i and target paragraph j to the end of the matrix.
+		"""
+		if hasattr(self.paragraph_similarities, 'getRegion'):
+			region = self.paragraph_similarities.getRegion(i, j)
+		else:
+			region = np.asarray(self.paragraph_similarities)[i:, j:]
+		rows, columns = np.nonzero(region>=self.acceptable_similarity)
+		self.columns = {}
+		for row, column in zip((rows+i).tolist(), (columns+j).tolist()):
+			self.columns.setdefault(row, []).append(column)
+		self.rows = sorted(self.columns.keys())
+		self.origin = (i, j)
+		
+		#Point each row to the next row that has not been removed, and sort rows by their last acceptable column for removal:
+		self.next_rows = list(range(0, len(self.rows)+1))
+		self.rows_by_last_column = sorted(range(0, len(self.rows)), key=lambda k: self.columns[self.rows[k]][-1])
+		self.pruned_rows = 0
+		self.pruned_column = j-1
+		
+	def prune(self, column):
+		"""
+		Removes from the search the rows of which all acceptable cells are at or to the left of a column.
+		"""
+		while self.pruned_rows<len(self.rows_by_last_column) and self.columns[self.rows[self.rows_by_last_column[self.pruned_rows]]][-1]<=column:
+			k = self.rows_by_last_column[self.pruned_rows]
+			self.next_rows[k] = k+1
+			self.pruned_rows += 1
+		self.pruned_column = max(self.pruned_column, column)
+		
+	def getNextRow(self, k):
+		"""
+		Finds the position in rows of the first row from position k onwards that has not been removed from the search, or len(rows) if there are none.
+		"""
+		root = k
+		while self.next_rows[root]!=root:
+			root = self.next_rows[root]
+		while self.next_rows[k]!=root:
+			self.next_rows[k], k = root, self.next_rows[k]
+		return root
+		
+	def getClosest(self, currXY):
+		"""
+		Finds the acceptable cell strictly below and to the right of a coordinate with the smallest Manhattan distance to it.
+		Ties are broken in favour of the cell with the smallest row.
+		
+		* *Parameters*:
+			* **currXY**: Current coordinate in the similarity matrix.
+		* *Output*:
+			* **x, y**: The coordinate of the closest acceptable cell, or None if there are none.
+		"""
+		#Charge the query to the budget:
+		if self.budget is not None:
+			self.budget.chargeSynchronizerScan()
+			
+		#Build the index if the query reaches outside of it or behind the rows already removed:
+		if self.origin is None or currXY[0]+1<self.origin[0] or currXY[1]+1<self.origin[1] or currXY[1]<self.pruned_column:
+			self.build(currXY[0]+1, currXY[1]+1)
+		self.prune(currXY[1])
+			
+		#Visit the remaining rows in order until no closer cell can be found. Each of them has a cell to the right of the query:
+		closest = None
+		distance = None
+		k = self.getNextRow(bisect_right(self.rows, currXY[0]))
+		while k<len(self.rows):
+			row = self.rows[k]
+			if distance is not None and (row-currXY[0])+1>=distance:
+				break
+			columns = self.columns[row]
+			column = columns[bisect_right(columns, currXY[1])]
+			if distance is None or (row-currXY[0])+(column-currXY[1])<distance:
+				closest = (row, column)
+				distance = (row-currXY[0])+(column-currXY[1])
+			k = self.getNextRow(k+1)
+		return closest
+		
+class StartingPointIndex:
+	"""
+	An index of the acceptable cells of a sentence similarity matrix, which finds the coordinate from which to start or recover the alignment path search without walking the matrix.
+	The acceptable cells are sorted in the order in which the search visits them: by anti-diagonal (i+j) and, within each anti-diagonal, from the bottom-left to the top-right.
+	Cells above or to the left of a query are removed from the search, since the alignment path only moves forward, so each query jumps straight to the first remaining cell of its anti-diagonal.
+	
+	* *Parameters*:
+		* **matrix**: A matrix of dimensions [sizec,sizes] or larger containing a similarity score for each sentence pair.
+		* **sizec**: The number of source sentences.
+		* **sizes**: The number of target sentences.
+		* **acceptable_similarity**: The minimum similarity score of an acceptable cell.
+		* **budget**: An AlignmentBudget to which each query is charged as a synchronizer scan. If None, queries are not limited.
+	"""
+	
+	def __init__(self, matrix, sizec, sizes, acceptable_similarity, budget=None):
+		self.sizec = sizec
+		self.sizes = sizes
+		self.budget = budget
+		if isinstance(matrix, BandedSimilarityMatrix):
+			rows, columns, values = matrix.getStoredCells()
+		else:
+			values = np.asarray(matrix)[:sizec, :sizes]
+			rows, columns = np.indices(values.shape)
+		acceptable = (values>=acceptable_similarity) & (values<1.1)
+		rows = rows[acceptable]
+		columns = columns[acceptable]
+		order = np.lexsort((-rows, rows+columns))
+		self.rows = rows[order].tolist()
+		self.columns = columns[order].tolist()
+		self.diagonals = (rows+columns)[order].tolist()
+		
+		#Sort the positions of the cells by row and by column for their removal:
+		self.positions_by_row = np.argsort(rows[order], kind='mergesort').tolist()
+		self.positions_by_column = np.argsort(columns[order], kind='mergesort').tolist()
+		self.reset()
+		
+	def reset(self):
+		"""
+		Restores all cells removed from the search.
+		"""
+		self.next_positions = list(range(0, len(self.rows)+1))
+		self.removed_by_row = 0
+		self.removed_by_column = 0
+		self.min_row = -1
+		self.min_column = -1
+		
+	def prune(self, min_row, min_column):
+		"""
+		Removes from the search the cells above a row or to the left of a column.
+		"""
+		if min_row<self.min_row or min_column<self.min_column:
+			self.reset()
+		while self.removed_by_row<len(self.positions_by_row) and self.rows[self.positions_by_row[self.removed_by_row]]<min_row:
+			k = self.positions_by_row[self.removed_by_row]
+			self.next_positions[k] = k+1
+			self.removed_by_row += 1
+		while self.removed_by_column<len(self.positions_by_column) and self.columns[self.positions_by_column[self.removed_by_column]]<min_column:
+			k = self.positions_by_column[self.removed_by_column]
+			self.next_positions[k] = k+1
+			self.removed_by_column += 1
+		self.min_row = min_row
+		self.min_column = min_column
+		
+	def getNextPosition(self, k):
+		"""
+		Finds the first position in search order from position k onwards of a cell that has not been removed from the search, or the number of cells if there are none.
+		"""
+		root = k
+		while self.next_positions[root]!=root:
+			root = self.next_positions[root]
+		while self.next_positions[k]!=root:
+			self.next_positions[k], k = root, self.next_positions[k]
+		return root
+		
+	def getStartingPoint(self, startpos):
+		"""
+		Finds the first acceptable cell after a coordinate, in search order, that is neither above nor to the left of it.
+		
+		* *Parameters*:
+			* **startpos**: The coordinate from which to start the search, or [-1,-1] to start from the beginning of the matrix.
+		* *Output*:
+			* **x, y**: The coordinate of the cell found, or [sizec,sizes] if there are none.
+		"""
+		if self.budget is not None:
+			self.budget.chargeSynchronizerScan()
+		diagonal = -1
+		if startpos[0]>-1 and startpos[1]>-1:
+			diagonal = startpos[0]+startpos[1]
+		self.prune(startpos[0], startpos[1])
+		k = self.getNextPosition(bisect_right(self.diagonals, diagonal))
+		if k<len(self.diagonals):
+			return [self.rows[k], self.columns[k]]
+		return [self.sizec, self.sizes]
+		
+class BandedSimilarityMatrix:
+	"""
+	A sentence similarity matrix that only stores the cells within a given distance of its length-normalised diagonal, so that its size grows linearly with the length of the paragraphs.
+	Like the regular search matrix, it has a border of 99999 values after the last row and column. Cells outside the band read as 0.
+	It can be read just like a numpy array, with either m[i][j] or m[i, j].
+	
+	* *Parameters*:
+		* **sentence_similarities**: A matrix of dimensions [sizec,sizes] containing a similarity score for each sentence pair, or a larger matrix if rows and columns are given.
+		* **band_width**: The maximum distance in columns between a stored cell and the diagonal.
+		* **rows**: The row of sentence_similarities of each source sentence. If None, they are 0 to sizec-1.
+		* **columns**: The column of sentence_similarities of each target sentence. If None, they are 0 to sizes-1.
+	"""
+	
+	def __init__(self, sentence_similarities, band_width, rows=None, columns=None):
+		sentence_similarities = np.asarray(sentence_similarities)
+		if rows is None:
+			rows = np.arange(sentence_similarities.shape[0])
+		if columns is None:
+			columns = np.arange(sentence_similarities.shape[1])
+		rows = np.asarray(rows, dtype=np.int64)
+		columns = np.asarray(columns, dtype=np.int64)
+		self.sizec = len(rows)
+		self.sizes = len(columns)
+		self.shape = (self.sizec+1, self.sizes+1)
+		self.band_width = band_width
+		
+		#Find the first column of the band in each row:
+		centers = np.round((np.arange(self.sizec)+0.5)*self.sizes/float(max(self.sizec, 1))-0.5).astype(np.int64)
+		self.starts = np.maximum(centers-band_width, 0)
+		self.ends = np.minimum(centers+band_width+1, self.sizes)
+		
+		#Copy the cells within the band:
+		offsets = self.starts[:, np.newaxis]+np.arange(2*band_width+1)
+		self.inside = offsets<self.ends[:, np.newaxis]
+		self.values = np.zeros(offsets.shape)
+		if self.sizes>0:
+			offsets = np.minimum(offsets, self.sizes-1)
+			self.values[self.inside] = sentence_similarities[rows[:, np.newaxis], columns[offsets]][self.inside]
+		
+	def __len__(self):
+		return self.shape[0]
+		
+	def __getitem__(self, key):
+		if isinstance(key, tuple):
+			return self.getValue(key[0], key[1])
+		return BandedSimilarityRow(self, key)
+		
+	def getValue(self, i, j):
+		"""
+		Produces the value of a cell of the matrix. Negative indexes are counted from the end, as in numpy.
+		"""
+		if i<0:
+			i += self.shape[0]
+		if j<0:
+			j += self.shape[1]
+		if i<0 or j<0 or i>self.sizec or j>self.sizes:
+			raise IndexError('Sentence indexes out of range: ' + str((i, j)))
+		if i==self.sizec or j==self.sizes:
+			return 99999.0
+		if j<self.starts[i] or j>=self.ends[i]:
+			return 0.0
+		return self.values[i, j-self.starts[i]]
+		
+	def getStoredCells(self):
+		"""
+		Produces the coordinates and values of all cells stored in the band.
+		
+		* *Output*:
+			* **rows**: A numpy array with the row of each cell.
+			* **columns**: A numpy array with the column of each cell.
+			* **values**: A numpy array with the value of each cell.
+		"""
+		rows, positions = np.nonzero(self.inside)
+		return rows, self.starts[rows]+positions, self.values[rows, positions]
+		
+class BandedSimilarityRow:
+	"""
+	A row of a BandedSimilarityMatrix, so that its cells can be read with m[i][j].
+	"""
+	
+	def __init__(self, matrix, i):
+		self.matrix = matrix
+		self.i = i
+		
+	def __len__(self):
+		return self.matrix.shape[1]
+		
+	def __getitem__(self, j):
+		return self.matrix.getValue(self.i, j)
+		
 class VicinityDrivenParagraphAligner(ParagraphAligner):
 	"""
 	Implements the vicinity-driven paragraph alignment algorithm proposed in:
@@ -26,40 +491,160 @@ class VicinityDrivenParagraphAligner(ParagraphAligner):
 	* *Parameters*:
 		* **similarity_model**: An instance of a class deriving from SimilarityModel.
 		* **acceptable_similarity**: The minimum similarity score between two paragraphs necessary for an alignment to be considered.
+		* **lazy**: If True, the similarity between two paragraphs is only calculated when the path search reads it, instead of calculating the full similarity matrix up front.
+		* **engine**: The engine used to search for the alignment path. Values supported: array (default) and python. The array engine reads the vicinities from a copy of the similarity matrix padded with a sentinel border, and produces the same paths as the python engine. Lazy similarity matrices are always searched with the python engine.
+		* **time_limit**: The maximum number of seconds spent searching for the alignment path of each pair of documents. If None, there is no limit.
+		* **max_similarity_evaluations**: The maximum number of paragraph similarities read while searching for the alignment path of each pair of documents. If None, there is no limit.
+		* **max_synchronizer_scans**: The maximum number of synchronizer searches made while searching for the alignment path of each pair of documents. If None, there is no limit.
+		* **anchoring**: If True, paragraphs that occur only once in each document and are identical after normalisation are aligned to each other up front, and similarities are only calculated and searched between the paragraphs in the gaps between them.
+		
+	If a search exceeds any of the limits, the path found until then is returned, and the budget_exceeded attribute of the AlignmentResult returned by alignParagraphsFromDocuments is True. The limits are started once by alignParagraphsFromDocuments for each pair of documents.
 	"""
 
-	def __init__(self, similarity_model=None, acceptable_similarity=0.3):
+	def __init__(self, similarity_model=None, acceptable_similarity=0.3, lazy=False, engine='array', time_limit=None, max_similarity_evaluations=None, max_synchronizer_scans=None, anchoring=False):
 		self.total_vicinity = set([(1,1),(1,0),(0,1),(2,1),(1,2)])
 		self.first_vicinity = set([(1,1),(1,0),(0,1)])
 		self.second_vicinity = set([(1,2),(2,1)])
 		self.acceptable_similarity = acceptable_similarity
 		self.similarity_model = similarity_model
+		self.lazy = lazy
+		self.engine = engine
+		self.time_limit = time_limit
+		self.max_similarity_evaluations = max_similarity_evaluations
+		self.max_synchronizer_scans = max_synchronizer_scans
+		self.anchoring = anchoring
 		
-	def alignParagraphsFromDocuments(self, p1s=[], p2s=[]):
+		#Fix the order in which the array engine visits the vicinities, so that ties are broken as in the python engine:
+		self.vicinity_order = list(self.total_vicinity)
+		self.first_positions = [k for k, pos in enumerate(self.vicinity_order) if pos in self.first_vicinity]
+		
+	def alignParagraphsFromDocuments(self, p1s=[], p2s=[], paragraph_similarities=None, budget=None):
 		"""
 		Finds alignments between a list of source and target paragraphs that compose a pair of comparable documents.
 		To do so, it produces a similarity matrix between the paragraphs in the source and target list, then finds an alignment path within it using a vicinity-driven approach.
+		Both outputs are returned in an AlignmentResult, of which the budget_exceeded attribute tells whether the search ran out of budget.
 		
 		* *Parameters*:
 			* **p1s**: A list of source paragraphs. Each paragraph is a list of sentences.
 			* **p2s**: A list of target paragraphs. Each paragraph is a list of sentences.
+			* **paragraph_similarities**: A precomputed matrix of dimensions [length(p1s),length(p2s)] containing a similarity score for each paragraph pair. If None, it is requested from the similarity model.
+			* **budget**: An AlignmentBudget that has already been started, which is not restarted. If None, a new budget with the limits of the aligner is started for this pair of documents.
 		* *Output*:
 			* **alignment_path**: A list of coordinates in the similarity matrix that describes which paragraphs are aligned.
 			* **aligned_paragraphs**: A list containing all pairs of aligned paragraphs.
 		"""
+		#Start the budget for this pair of documents, unless a started one is given:
+		if budget is None:
+			budget = self.getBudget()
+		
+		#Align identical paragraphs up front and search only the gaps between them:
+		if self.anchoring:
+			alignment_path = self.getAnchoredParagraphAlignmentPath(p1s, p2s, paragraph_similarities, budget)
+			return AlignmentResult((alignment_path, self.getActualAlignedParagraphs(p1s, p2s, alignment_path)), budget.exceeded)
+			
 		#Get similarity model:
-		paragraph_similarities = self.similarity_model.getSimilarityMapBetweenParagraphsOfDocuments(p1s, p2s)
+		if paragraph_similarities is not None:
+			pass
+		elif self.lazy:
+			paragraph_similarities = self.similarity_model.getLazySimilarityMapBetweenParagraphsOfDocuments(p1s, p2s)
+		else:
+			paragraph_similarities = self.similarity_model.getSimilarityMapBetweenParagraphsOfDocuments(p1s, p2s)
 		
 		#Calculate alignment path:
-		alignment_path = self.getParagraphAlignmentPath(p1s, p2s, paragraph_similarities)
+		alignment_path = self.getParagraphAlignmentPath(p1s, p2s, paragraph_similarities, budget)
 		
 		#Produce actual alignments:
 		aligned_paragraphs = self.getActualAlignedParagraphs(p1s, p2s, alignment_path)
 		
 		#Return alignment path:
-		return alignment_path, aligned_paragraphs
+		return AlignmentResult((alignment_path, aligned_paragraphs), budget.exceeded)
+		
+	def getParameters(self):
+		"""
+		Produces the parameters of the aligner that determine the alignments it finds, apart from its similarity model and limits.
+		
+		* *Output*:
+			* **parameters**: A dictionary connecting parameter names to their values.
+		"""
+		return {'acceptable_similarity': self.acceptable_similarity, 'anchoring': self.anchoring}
+		
+	def getBudget(self):
+		"""
+		Produces a new AlignmentBudget with the limits of the aligner, started now, so that searches never share the state of their budgets unless they are given the same one.
+		"""
+		return AlignmentBudget(self.time_limit, self.max_similarity_evaluations, self.max_synchronizer_scans)
+		
+	def sweepParagraphAlignments(self, p1s=[], p2s=[], settings=[], paragraph_similarities=None):
+		"""
+		Finds alignments between a list of source and target paragraphs once for each of a list of parameter settings, calculating their similarity matrix only once.
+		
+		* *Parameters*:
+			* **p1s**: A list of source paragraphs. Each paragraph is a list of sentences.
+			* **p2s**: A list of target paragraphs. Each paragraph is a list of sentences.
+			* **settings**: A list of dictionaries connecting parameter names of the aligner, such as "acceptable_similarity", to the values to use. Parameters not included keep the aligner's values.
+			* **paragraph_similarities**: A precomputed matrix of dimensions [length(p1s),length(p2s)] containing a similarity score for each paragraph pair. If None, it is requested from the similarity model.
+		* *Output*:
+			* **results**: A list containing, for each setting, the output of alignParagraphsFromDocuments.
+		"""
+		#Get similarity model:
+		if paragraph_similarities is not None:
+			pass
+		elif self.lazy:
+			paragraph_similarities = self.similarity_model.getLazySimilarityMapBetweenParagraphsOfDocuments(p1s, p2s)
+		else:
+			paragraph_similarities = self.similarity_model.getSimilarityMapBetweenParagraphsOfDocuments(p1s, p2s)
+			
+		#Align the paragraphs with each setting:
+		results = []
+		for setting in settings:
+			results.append(getAlignerWithSettings(self, setting).alignParagraphsFromDocuments(p1s, p2s, paragraph_similarities))
+		return results
+		
+	def getAnchoredParagraphAlignmentPath(self, p1s, p2s, paragraph_similarities=None, budget=None):
+		"""
+		Aligns the paragraphs that occur only once in each document and are identical after normalisation, then searches for the alignment path between the paragraphs in each gap between them.
+		All gaps share the same budget. Once it runs out, the remaining gaps are not searched, and only their anchors are kept.
+		
+		* *Parameters*:
+			* **p1s**: A list of source paragraphs. Each paragraph is a list of sentences.
+			* **p2s**: A list of target paragraphs. Each paragraph is a list of sentences.
+			* **paragraph_similarities**: A precomputed matrix of dimensions [length(p1s),length(p2s)] containing a similarity score for each paragraph pair. If None, similarities are requested from the similarity model for the paragraphs in the gaps only.
+			* **budget**: An AlignmentBudget that has already been started, which is not restarted. If None, a new budget with the limits of the aligner is started for all the gaps.
+		* *Output*:
+			* **alignment_path**: A list of coordinates in the similarity matrix that describes which paragraphs are aligned.
+		"""
+		#Start the budget once for all the gaps, unless a started one is given:
+		if budget is None:
+			budget = self.getBudget()
+
+		#Find anchors:
+		keys1 = ['\n'.join([getNormalizedText(sentence) for sentence in p]) for p in p1s]
+		keys2 = ['\n'.join([getNormalizedText(sentence) for sentence in p]) for p in p2s]
+		anchors = getExactMatchAnchors(keys1, keys2)
+		
+		#Align the paragraphs in each gap, followed by the anchor that closes it:
+		alignment_path = []
+		for k, (start1, end1, start2, end2) in enumerate(getAnchorGaps(anchors, len(p1s), len(p2s))):
+			if end1>start1 and end2>start2 and not budget.exceeded:
+				gap1 = p1s[start1:end1]
+				gap2 = p2s[start2:end2]
+				if hasattr(paragraph_similarities, 'getBlockSimilarities'):
+					gap_similarities = paragraph_similarities.getBlockSimilarities(start1, start2, end1, end2)
+				elif paragraph_similarities is not None:
+					gap_similarities = np.asarray(paragraph_similarities)[start1:end1, start2:end2]
+				elif self.lazy:
+					gap_similarities = self.similarity_model.getLazySimilarityMapBetweenParagraphsOfDocuments(gap1, gap2)
+				else:
+					gap_similarities = self.similarity_model.getSimilarityMapBetweenParagraphsOfDocuments(gap1, gap2)
+				for node in self.getParagraphAlignmentPath(gap1, gap2, gap_similarities, budget, continued=k>0):
+					alignment_path.append([[start1+x for x in node[0]], [start2+y for y in node[1]]])
+			if k<len(anchors):
+				alignment_path.append([[anchors[k][0]], [anchors[k][1]]])
+		
+		#Return alignment path:
+		return alignment_path
 		
-	def getParagraphAlignmentPath(self, p1s, p2s, paragraph_similarities):
+	def getParagraphAlignmentPath(self, p1s, p2s, paragraph_similarities, budget=None, continued=False):
 		"""
 		Searches for the alignment path in a matrix containing similarity scores for all paragraph pairs.
 		
@@ -67,62 +652,148 @@ class VicinityDrivenParagraphAligner(ParagraphAligner):
 			* **p1s**: A list of source paragraphs. Each paragraph is a list of sentences.
 			* **p2s**: A list of target paragraphs. Each paragraph is a list of sentences.
 			* **paragraph_similarities**: A matrix of dimensions [length(p1s),length(p2s)] containing a similarity score for each paragraph pair.
+			* **budget**: An AlignmentBudget that has already been started, which is not restarted. If None, a new budget with the limits of the aligner is started for this search.
+			* **continued**: If True, the search continues from an alignment just before the first source and target paragraphs, such as an anchor, instead of aligning the first paragraphs to each other.
 		* *Output*:
-			* **compact_path**: A list of coordinates in the similarity matrix that describes which paragraphs are aligned.
+			* **compact_path**: A list of coordinates in the similarity matrix that describes which paragraphs are aligned. If the search exceeds its budget, only the alignments found until then are included.
 		"""
 		#Get paragraph set sizes:
 		sizep1 = len(p1s)
 		sizep2 = len(p2s)
 		
-		#Start vicinity-driven path search:
+		#Start vicinity-driven path search, from the alignment before the paragraphs if the search is continued:
 		path = [(0, 0)]
 		currXY = (0, 0)
+		if continued:
+			path = []
+			currXY = (-1, -1)
+		if budget is None:
+			budget = self.getBudget()
+		if budget.exceeded:
+			return self.getCompactAlignmentPath(path)
+		
+		#Create index for the search of synchronizers:
+		synchronizer_index = SynchronizerIndex(paragraph_similarities, self.acceptable_similarity, budget)
+		
+		#Pad the matrix for the array engine:
+		padded_similarities = None
+		if self.engine=='array' and not hasattr(paragraph_similarities, 'getRegion'):
+			padded_similarities = self.getPaddedSimilarityMatrix(paragraph_similarities)
 		
 		#While matrix edges are not found, do:
-		while currXY[0]<sizep1-1 or currXY[1]<sizep2-1:
-			nextXY, nextXYsim = self.getNextAlignment(currXY, paragraph_similarities)
-			if nextXY[0]==sizep1-1 and nextXY[1]==sizep2-1:
-				if nextXYsim>=0.3:
+		try:
+			while currXY[0]<sizep1-1 or currXY[1]<sizep2-1:
+				budget.chargeSimilarityEvaluations(len(self.total_vicinity))
+				#The array engine cannot read the vicinity of the alignment before the matrix of a continued search:
+				if padded_similarities is not None and currXY[0]>=0 and currXY[1]>=0:
+					nextXY, nextXYsim = self.getNextAlignmentFromPaddedMatrix(currXY, padded_similarities, synchronizer_index)
+				else:
+					nextXY, nextXYsim = self.getNextAlignment(currXY, paragraph_similarities, synchronizer_index)
+				if nextXY[0]==sizep1-1 and nextXY[1]==sizep2-1:
+					if nextXYsim>=0.3:
+						path.append(nextXY)
+				else:
 					path.append(nextXY)
-			else:
-				path.append(nextXY)
-			currXY = nextXY
-
-		#Structure path found:
-		for j, node in enumerate(path):
-			path[j] = [[node[0]],[node[1]]]
+				currXY = nextXY
+		#If the budget runs out, keep the path found so far:
+		except AlignmentBudgetExceeded:
+			pass
 
 		#Compact the path with 1-1, 1-N and N-1 alignments:
+		compact_path = self.getCompactAlignmentPath(path)
+		
+		#Return resulting path:
+		return compact_path
+		
+	def getCompactAlignmentPath(self, path):
+		"""
+		Merges consecutive coordinates of an alignment path that share a source or target paragraph into 1-N and N-1 alignments, in a single pass over the path.
+		
+		* *Parameters*:
+			* **path**: A list of (x, y) coordinates in the similarity matrix.
+		* *Output*:
+			* **compact_path**: A list of alignments, each composed of a list of source paragraph indexes and a list of target paragraph indexes.
+		"""
 		compact_path = []
-		while len(path)>0:
-			top = path[0]
-			if len(path)==1:
-				compact_path.append(top)
-				path.pop(0)
+		top = None
+		for node in path:
+			#Absorb the coordinate into the current alignment if they share a single paragraph:
+			if top is not None and top[0]==[node[0]]:
+				top[1].append(node[1])
+			elif top is not None and top[1]==[node[1]]:
+				top[0].append(node[0])
+			#If not, start a new alignment:
 			else:
-				next = path[1]
-				if top[0]==next[0]:
-					for al in next[1]:
-						top[1].append(al)
-					path.pop(1)
-				elif top[1]==next[1]:
-					for al in next[0]:
-						top[0].append(al)
-					path.pop(1)
-				else:
+				if top is not None:
 					compact_path.append(top)
-					path.pop(0)
-		
-		#Return resulting path:
+				top = [[node[0]],[node[1]]]
+		if top is not None:
+			compact_path.append(top)
 		return compact_path
 		
-	def getNextAlignment(self, currXY, paragraph_similarities):
+	def getPaddedSimilarityMatrix(self, paragraph_similarities):
+		"""
+		Copies a paragraph similarity matrix into a larger one with a border of -99999 values after its last row and column, wide enough for all vicinities to be read without bounds checks.
+		
+		* *Parameters*:
+			* **paragraph_similarities**: A matrix of dimensions [length(p1s),length(p2s)] containing a similarity score for each paragraph pair.
+		* *Output*:
+			* **padded_similarities**: A numpy array of dimensions [length(p1s)+2,length(p2s)+2].
+		"""
+		similarities = np.asarray(paragraph_similarities, dtype=np.float64)
+		padded_similarities = np.empty((similarities.shape[0]+2, similarities.shape[1]+2))
+		padded_similarities.fill(-99999)
+		padded_similarities[:similarities.shape[0], :similarities.shape[1]] = similarities
+		return padded_similarities
+		
+	def getNextAlignmentFromPaddedMatrix(self, currXY, padded_similarities, synchronizer_index=None):
+		"""
+		Searches for the next alignment during the search for the alignment path, reading all vicinities from a 3x3 window of a padded similarity matrix.
+		It produces the same alignments as getNextAlignment.
+		
+		* *Parameters*:
+			* **currXY**: Current coordinate in the similarity matrix from which to continue the search.
+			* **padded_similarities**: A similarity matrix produced by getPaddedSimilarityMatrix.
+			* **synchronizer_index**: A SynchronizerIndex of the original similarity matrix, used if a synchronizer is needed. If None, a new one is created.
+		* *Output*:
+			* **x, y**: The coordinate for the next alignment.
+		"""
+		#Get the similarities from all reachable candidates:
+		window = padded_similarities[currXY[0]:currXY[0]+3, currXY[1]:currXY[1]+3].tolist()
+		sims = [window[pos[0]][pos[1]] for pos in self.vicinity_order]
+		
+		#Check whether the first vicinity has a similar enough candidate:
+		best = self.first_positions[0]
+		for k in self.first_positions:
+			if sims[k]>sims[best]:
+				best = k
+		if sims[best]<self.acceptable_similarity:
+			#If not, check the second vicinity:
+			best = 0
+			for k in range(len(sims)):
+				if sims[k]>sims[best]:
+					best = k
+			#If not, get a next synchronizer outside the reachable vicinity:
+			if sims[best]<self.acceptable_similarity:
+				if synchronizer_index is None:
+					synchronizer_index = SynchronizerIndex(padded_similarities[:-2, :-2], self.acceptable_similarity)
+				finalNextXY = synchronizer_index.getClosest(currXY)
+				if finalNextXY is None:
+					finalNextXY = (padded_similarities.shape[0]-3, padded_similarities.shape[1]-3)
+				return finalNextXY, padded_similarities[finalNextXY[0], finalNextXY[1]]
+		
+		#Return the best candidate:
+		pos = self.vicinity_order[best]
+		return (currXY[0]+pos[0], currXY[1]+pos[1]), sims[best]
+		
+	def getNextAlignment(self, currXY, paragraph_similarities, synchronizer_index=None):
 		"""
 		Searches for the next alignment during the search for the alignment path.
 		
 		* *Parameters*:
 			* **currXY**: Current coordinate in the similarity matrix from which to continue the search.
 			* **paragraph_similarities**: A matrix containing a similarity score for each paragraph pair.
+			* **synchronizer_index**: A SynchronizerIndex of paragraph_similarities, used if a synchronizer is needed. If None, a new one is created.
 		* *Output*:
 			* **x, y**: The coordinate for the next alignment.
 		"""
@@ -132,7 +803,8 @@ class VicinityDrivenParagraphAligner(ParagraphAligner):
 			candXY = (currXY[0]+pos[0], currXY[1]+pos[1])
 			sim = -99999
 			try:
-				sim = paragraph_similarities[candXY[0]][candXY[1]]
+				if candXY[0]>=0 and candXY[1]>=0:
+					sim = paragraph_similarities[candXY[0]][candXY[1]]
 			except Exception:
 				pass
 			cands[candXY] = sim
@@ -152,39 +824,33 @@ class VicinityDrivenParagraphAligner(ParagraphAligner):
 			all = [cands[c] for c in cands]
 			#If not, get a next synchronizer outside the reachable vicinity
 			if np.max(all)<self.acceptable_similarity:
-				finalNextXY = self.getNextSynchronizer(currXY, paragraph_similarities)
+				finalNextXY = self.getNextSynchronizer(currXY, paragraph_similarities, synchronizer_index)
 				return finalNextXY, paragraph_similarities[finalNextXY[0]][finalNextXY[1]]
 			else:
 				return winners[0], cands[winners[0]]
 
-	def getNextSynchronizer(self, currXY, paragraph_similarities):
+	def getNextSynchronizer(self, currXY, paragraph_similarities, synchronizer_index=None):
 		"""
 		If it was impossible to find any suitable alignments within the vicinities specified, then search for the acceptable alignment outside the vicinities that is closest to the current search coordinate.
 		
 		* *Parameters*:
 			* **currXY**: Current coordinate in the similarity matrix from which to continue the search.
 			* **paragraph_similarities**: A matrix containing a similarity score for each paragraph pair.
+			* **synchronizer_index**: A SynchronizerIndex of paragraph_similarities. If None, a new one is created.
 		* *Output*:
 			* **x, y**: The coordinate for the next acceptable alignment outside the valid vicinities.
 		"""
-		#Start search for next synchronizer:
-		cands = {}
-		orig = currXY
-		last = [len(paragraph_similarities), len(paragraph_similarities[0])]
-		
-		#Find all candidates "in front" of currXY that have good enough similarity:
-		for i in range(orig[0], last[0]):
-			for j in range(orig[1], last[1]):
-				if i!=orig[0] and j!=orig[1] and paragraph_similarities[i][j]>=self.acceptable_similarity:
-					cands[(i, j)] = (i-orig[0])+(j-orig[1])
+		#Find the closest candidate "in front" of currXY that has good enough similarity:
+		if synchronizer_index is None:
+			synchronizer_index = SynchronizerIndex(paragraph_similarities, self.acceptable_similarity)
+		closest = synchronizer_index.getClosest(currXY)
 					
-		#If there are any, get the best one:
-		if len(cands)>0:
-			closest = sorted(cands.keys(), key=cands.__getitem__)
-			return closest[0]
+		#If there is one, return it:
+		if closest is not None:
+			return closest
 		#Otherwise, return the last position in the alignment matrix:
 		else:
-			return (last[0]-1, last[1]-1)
+			return (len(paragraph_similarities)-1, len(paragraph_similarities[0])-1)
 			
 	def getActualAlignedParagraphs(self, p1s, p2s, alignment_path):
 		"""
@@ -239,41 +905,159 @@ class VicinityDrivenSentenceAligner(SentenceAligner):
 		* **similarity_model**: An instance of a class deriving from SimilarityModel.
 		* **acceptable_similarity**: The minimum similarity score between two paragraphs necessary for an alignment to be considered.
 		* **similarity_slack**: The maximum amount of similarity that can be lost after each step of incrementing N when finding for a 1-N or N-1 alignment.
+		* **band_width**: If provided, the similarity matrix of paragraphs with more than 2*band_width+1 target sentences only stores the cells within band_width columns of its length-normalised diagonal. Cells outside the band are treated as dissimilar.
+		* **time_limit**: The maximum number of seconds spent searching for the alignment paths of each pair of paragraphs, or of all the paragraphs of a pair of documents aligned with MASSAligner's getDocumentAlignments. If None, there is no limit.
+		* **max_similarity_evaluations**: The maximum number of similarities between buffers of sentences calculated while searching for the same alignment paths. If None, there is no limit.
+		* **max_synchronizer_scans**: The maximum number of starting point searches made while searching for the same alignment paths. If None, there is no limit.
+		* **anchoring**: If True, sentences that occur only once in each paragraph and are identical after normalisation are aligned to each other up front, and similarities are only calculated and searched between the sentences in the gaps between them.
+		
+	If a search exceeds any of the limits, the alignments completed until then are returned, and the budget_exceeded attribute of the AlignmentResult returned by alignSentencesFromParagraphs is True. Searches that share the exceeded budget return no alignments.
 	"""
 
-	def __init__(self, similarity_model=None, acceptable_similarity=0.2, similarity_slack=0.05):
+	def __init__(self, similarity_model=None, acceptable_similarity=0.2, similarity_slack=0.05, band_width=None, time_limit=None, max_similarity_evaluations=None, max_synchronizer_scans=None, anchoring=False):
 		self.total_vicinity = set([(1,1),(1,0),(0,1),(2,1),(1,2)])
 		self.first_vicinity = set([(1,1),(1,0),(0,1)])
 		self.second_vicinity = set([(1,2),(2,1)])
 		self.acceptable_similarity = acceptable_similarity
 		self.similarity_slack = similarity_slack
 		self.similarity_model = similarity_model
+		self.band_width = band_width
+		self.time_limit = time_limit
+		self.max_similarity_evaluations = max_similarity_evaluations
+		self.max_synchronizer_scans = max_synchronizer_scans
+		self.anchoring = anchoring
 		
-	def alignSentencesFromParagraphs(self, p1=[], p2=[]):
+	def alignSentencesFromParagraphs(self, p1=[], p2=[], sentence_similarities=None, buffer_similarity=None, budget=None):
 		"""
 		Finds alignments between a list of source and target sentences that compose a pair of aligned paragraphs.
 		To do so, it produces a similarity matrix between the sentences in the source and target sentences, then finds an alignment path within it using a vicinity-driven approach.
+		Both outputs are returned in an AlignmentResult, of which the budget_exceeded attribute tells whether the search ran out of budget.
 		
 		* *Parameters*:
 			* **p1**: A source paragraph. A paragraph is a list of sentences.
 			* **p2**: A target paragraph. A paragraph is a list of sentences.
+			* **sentence_similarities**: A precomputed matrix of dimensions [length(p1),length(p2)] containing a similarity score for each sentence pair, indexed by their positions. If None, it is requested from the similarity model.
+			* **buffer_similarity**: A precomputed object that calculates the similarity between buffers of sentences of p1 and p2. If None, it is requested from the similarity model.
+			* **budget**: An AlignmentBudget that has already been started, which is not restarted, such as one shared by all the paragraphs of a pair of documents. If None, a new budget with the limits of the aligner is started for this pair of paragraphs.
 		* *Output*:
 			* **alignment_path**: A list of coordinates in the similarity matrix that describes which sentences are aligned.
 			* **aligned_sentences**: A list containing all pairs of aligned sentences.
 		"""
+		#Start the budget for this pair of paragraphs, unless a started one is given:
+		if budget is None:
+			budget = self.getBudget()
+		
+		#Align identical sentences up front and search only the gaps between them:
+		if self.anchoring:
+			alignment_path = self.getAnchoredSentenceAlignmentPath(p1, p2, sentence_similarities, buffer_similarity, budget)
+			return AlignmentResult((alignment_path, self.getActualAlignedSentences(p1, p2, alignment_path)), budget.exceeded)
+			
 		#Get similarity model:
-		sentence_similarities, sentence_indexes = self.similarity_model.getSimilarityMapBetweenSentencesOfParagraphs(p1, p2)
+		sentence_indexes = None
+		if sentence_similarities is None:
+			sentence_similarities, sentence_indexes = self.similarity_model.getSimilarityMapBetweenSentencesOfParagraphs(p1, p2)
+		if buffer_similarity is None:
+			buffer_similarity = self.similarity_model.getBufferSimilarity(p1, p2)
 		
 		#Calculate alignment path:
-		alignment_path = self.getSentenceAlignmentPath(p1, p2, sentence_similarities, sentence_indexes)
+		alignment_path = self.getSentenceAlignmentPath(p1, p2, sentence_similarities, sentence_indexes, buffer_similarity, budget)
 
 		#Produce actual alignments:
 		aligned_sentences = self.getActualAlignedSentences(p1, p2, alignment_path)
 		
 		#Return alignment path:
-		return alignment_path, aligned_sentences
+		return AlignmentResult((alignment_path, aligned_sentences), budget.exceeded)
+		
+	def getParameters(self):
+		"""
+		Produces the parameters of the aligner that determine the alignments it finds, apart from its similarity model and limits.
+		
+		* *Output*:
+			* **parameters**: A dictionary connecting parameter names to their values.
+		"""
+		return {'acceptable_similarity': self.acceptable_similarity, 'similarity_slack': self.similarity_slack, 'band_width': self.band_width, 'anchoring': self.anchoring}
+		
+	def getBudget(self):
+		"""
+		Produces a new AlignmentBudget with the limits of the aligner, started now, so that searches never share the state of their budgets unless they are given the same one.
+		"""
+		return AlignmentBudget(self.time_limit, self.max_similarity_evaluations, self.max_synchronizer_scans)
+		
+	def sweepSentenceAlignments(self, p1=[], p2=[], settings=[], sentence_similarities=None, buffer_similarity=None):
+		"""
+		Finds alignments between a list of source and target sentences once for each of a list of parameter settings, calculating their similarity matrix and sentence vectors only once.
+		Since buffer similarities are memoised, the ones calculated for a setting are reused by all others.
+		
+		* *Parameters*:
+			* **p1**: A source paragraph. A paragraph is a list of sentences.
+			* **p2**: A target paragraph. A paragraph is a list of sentences.
+			* **settings**: A list of dictionaries connecting parameter names of the aligner, such as "acceptable_similarity" and "similarity_slack", to the values to use. Parameters not included keep the aligner's values.
+			* **sentence_similarities**: A precomputed matrix of dimensions [length(p1),length(p2)] containing a similarity score for each sentence pair, indexed by their positions. If None, it is requested from the similarity model.
+			* **buffer_similarity**: A precomputed object that calculates the similarity between buffers of sentences of p1 and p2. If None, it is requested from the similarity model.
+		* *Output*:
+			* **results**: A list containing, for each setting, the output of alignSentencesFromParagraphs.
+		"""
+		#Get similarity model, indexed by sentence positions:
+		if sentence_similarities is None:
+			sentence_similarities, sentence_indexes = self.similarity_model.getSimilarityMapBetweenSentencesOfParagraphs(p1, p2)
+			if sentence_indexes is not None:
+				sentence_similarities = np.asarray(sentence_similarities)[np.ix_([sentence_indexes[s1] for s1 in p1], [sentence_indexes[s2] for s2 in p2])]
+		if buffer_similarity is None:
+			buffer_similarity = self.similarity_model.getBufferSimilarity(p1, p2)
+			
+		#Align the sentences with each setting:
+		results = []
+		for setting in settings:
+			results.append(getAlignerWithSettings(self, setting).alignSentencesFromParagraphs(p1, p2, sentence_similarities, buffer_similarity))
+		return results
+		
+	def getAnchoredSentenceAlignmentPath(self, p1, p2, sentence_similarities=None, buffer_similarity=None, budget=None):
+		"""
+		Aligns the sentences that occur only once in each paragraph and are identical after normalisation, then searches for the alignment path between the sentences in each gap between them.
+		All gaps share the same budget. Once it runs out, the remaining gaps are not searched, and only their anchors are kept.
+
+		* *Parameters*:
+			* **p1**: A source paragraph. A paragraph is a list of sentences.
+			* **p2**: A target paragraph. A paragraph is a list of sentences.
+			* **sentence_similarities**: A precomputed matrix of dimensions [length(p1),length(p2)] containing a similarity score for each sentence pair, indexed by their positions. If None, similarities are requested from the similarity model for the sentences in the gaps only.
+			* **buffer_similarity**: A precomputed object that calculates the similarity between buffers of sentences of p1 and p2, which must implement getSubBufferSimilarity. If None, one is requested from the similarity model for each gap.
+			* **budget**: An AlignmentBudget that has already been started, which is not restarted. If None, a new budget with the limits of the aligner is started for all the gaps.
+		* *Output*:
+			* **alignment_path**: A list of coordinates in the similarity matrix that describes which sentences are aligned.
+		"""
+		#Start the budget once for all the gaps, unless a started one is given:
+		if budget is None:
+			budget = self.getBudget()
+
+		#Find anchors:
+		anchors = getExactMatchAnchors([getNormalizedText(sentence) for sentence in p1], [getNormalizedText(sentence) for sentence in p2])
+		
+		#Align the sentences in each gap, followed by the anchor that closes it:
+		alignment_path = []
+		for k, (start1, end1, start2, end2) in enumerate(getAnchorGaps(anchors, len(p1), len(p2))):
+			if end1>start1 and end2>start2 and not budget.exceeded:
+				gap1 = p1[start1:end1]
+				gap2 = p2[start2:end2]
+				gap_indexes = None
+				if sentence_similarities is not None:
+					gap_similarities = np.asarray(sentence_similarities)[start1:end1, start2:end2]
+				else:
+					gap_similarities, gap_indexes = self.similarity_model.getSimilarityMapBetweenSentencesOfParagraphs(gap1, gap2)
+				if buffer_similarity is not None:
+					gap_buffer_similarity = buffer_similarity.getSubBufferSimilarity(range(start1, end1), range(start2, end2))
+				else:
+					gap_buffer_similarity = self.similarity_model.getBufferSimilarity(gap1, gap2)
+				#Skip the empty nodes produced when the gap has no starting point:
+				for node in self.getSentenceAlignmentPath(gap1, gap2, gap_similarities, gap_indexes, gap_buffer_similarity, budget):
+					if len(node)==2 and len(node[0])>0 and len(node[1])>0:
+						alignment_path.append(([start1+x for x in node[0]], [start2+y for y in node[1]]))
+			if k<len(anchors):
+				alignment_path.append(([anchors[k][0]], [anchors[k][1]]))
+		
+		#Return alignment path:
+		return alignment_path
 	
-	def getSentenceAlignmentPath(self, p1, p2, sentence_similarities, sentence_indexes):
+	def getSentenceAlignmentPath(self, p1, p2, sentence_similarities, sentence_indexes, buffer_similarity=None, budget=None):
 		"""
 		Produces a similarity matrix and searches for the alignment path within it.
 		
@@ -281,58 +1065,89 @@ class VicinityDrivenSentenceAligner(SentenceAligner):
 			* **p1**: A source paragraph. A paragraph is a list of sentences.
 			* **p2**: A target paragraph. A paragraph is a list of sentences.
 			* **sentence_similarities**: A matrix containing a similarity score between all possible pairs of sentences in the union of p1 and p2. The matrix's height and width are equal and equivalent to the number of distinct sentences present in the union of p1 and p2.
-			* **sentence_indexes**: A map connecting each sentence to its numerical index in the sentence_similarities matrix.
+			* **sentence_indexes**: A map connecting each sentence to its numerical index in the sentence_similarities matrix. If None, sentence_similarities is indexed by sentence positions.
+			* **buffer_similarity**: An object that calculates the similarity between buffers of sentences of p1 and p2, as produced by the similarity model's getBufferSimilarity function. If None, a new one is requested from the similarity model.
+			* **budget**: An AlignmentBudget that has already been started, which is not restarted. If None, a new budget with the limits of the aligner is started for this search.
 		* *Output*:
-			* **path**: A list of coordinates in the similarity matrix that describes which sentences are aligned.
+			* **path**: A list of coordinates in the similarity matrix that describes which sentences are aligned. If the search exceeds its budget, only the alignments completed until then are included.
 		"""
 		#Get paragraph sizes:
 		sizep1 = len(p1)
 		sizep2 = len(p2)
 		
+		#Start the budget for this search, unless a started one is given:
+		if budget is None:
+			budget = self.getBudget()
+		
+		#If the budget has already run out, do not search:
+		if budget.exceeded:
+			return []
+
+		#Get buffer similarity calculator:
+		if buffer_similarity is None:
+			buffer_similarity = self.similarity_model.getBufferSimilarity(p1, p2)
+		
 		#Start vicinity-driven path search:
 		matrix = self.getProbabilityMatrix(p1, p2, sentence_similarities, sentence_indexes)
+		buffer_similarity = BudgetedBufferSimilarity(buffer_similarity, budget)
 		
 		#Start search for alignment path:
 		path = []
-		cbuffer = ''
-		sbuffer = ''
-		starting_point = self.findStartingPoint(matrix, p1, p2, [-1,-1])
-		if starting_point[0]>=len(p1) or starting_point[1]>=len(p2):
-			return [], []
-		currXY = starting_point
-		
-		#Instantiate buffers:
-		cbuffer = p1[currXY[0]]
-		final_cbuffer = [currXY[0]]
-		sbuffer = p2[currXY[1]]
-		final_sbuffer = [currXY[1]]
+		starting_points = StartingPointIndex(matrix, len(p1), len(p2), self.acceptable_similarity, budget)
+		try:
+			starting_point = self.findStartingPoint(matrix, p1, p2, [-1,-1], starting_points)
+			if starting_point[0]>=len(p1) or starting_point[1]>=len(p2):
+				return [], []
+			currXY = starting_point
+			
+			#Instantiate buffers:
+			final_cbuffer = [currXY[0]]
+			final_sbuffer = [currXY[1]]
+			
+			#Search for the rest of the path:
+			self.searchSentenceAlignmentPath(matrix, p1, p2, path, currXY, final_cbuffer, final_sbuffer, buffer_similarity, starting_points)
+		#If the budget runs out, keep the alignments completed so far:
+		except AlignmentBudgetExceeded:
+			pass
+		return path
+		
+	def searchSentenceAlignmentPath(self, matrix, p1, p2, path, currXY, final_cbuffer, final_sbuffer, buffer_similarity, starting_points):
+		"""
+		Searches for the alignment path from a starting point, appending each alignment to the path as soon as it is complete.
 		
+		* *Parameters*:
+			* **matrix**: A similarity matrix produced by getProbabilityMatrix.
+			* **p1**: A source paragraph. A paragraph is a list of sentences.
+			* **p2**: A target paragraph. A paragraph is a list of sentences.
+			* **path**: The list to which the alignments found are appended.
+			* **currXY**: The starting point of the search.
+			* **final_cbuffer**: The indexes of the source sentences of the alignment at the starting point.
+			* **final_sbuffer**: The indexes of the target sentences of the alignment at the starting point.
+			* **buffer_similarity**: An object that calculates the similarity between buffers of sentences of p1 and p2.
+			* **starting_points**: A StartingPointIndex of the matrix.
+		"""
 		#While the edge of the similarity matrix is not reached, do:
 		while currXY[0]<len(p1)-1 and currXY[1]<len(p2)-1:
-			bestNextXY, bestNextXYProb = self.getBestNextHypothesis(matrix, p1, p2, cbuffer, sbuffer, currXY)
+			bestNextXY, bestNextXYProb = self.getBestNextHypothesis(matrix, p1, p2, final_cbuffer, final_sbuffer, currXY, buffer_similarity, starting_points)
 			#Check to see if best is diagonal:
 			if bestNextXY[0]==currXY[0]+1 and bestNextXY[1]==currXY[1]+1:
 				path.append((final_cbuffer, final_sbuffer))
 				currXY = bestNextXY
-				cbuffer = p1[currXY[0]]
 				final_cbuffer = [currXY[0]]
-				sbuffer = p2[currXY[1]]
 				final_sbuffer = [currXY[1]]
 			#Check to see if downards is best:
 			elif bestNextXY[0]==currXY[0]+1 and bestNextXY[1]==currXY[1]:
 				#Keep moving downards until the alignment stops improving:
 				anchor = bestNextXY[0]+1
-				prevsim = self.similarity_model.getTextSimilarity(cbuffer, sbuffer)
-				cbuffer += ' ' + p1[bestNextXY[0]]
+				prevsim = buffer_similarity.getSimilarity(final_cbuffer, final_sbuffer)
 				final_cbuffer.append(bestNextXY[0])
 				currsim = bestNextXYProb
 				while anchor<len(p1) and currsim>matrix[anchor][bestNextXY[1]+1] and currsim>prevsim-self.similarity_slack:
 					anchor += 1
 					if anchor<len(p1):
 						prevsim = currsim
-						currsim = self.similarity_model.getTextSimilarity(cbuffer+' '+p1[anchor], sbuffer)
+						currsim = buffer_similarity.getSimilarity(final_cbuffer+[anchor], final_sbuffer)
 						if currsim>prevsim-self.similarity_slack and currsim>matrix[anchor][bestNextXY[1]+1]:
-							cbuffer += ' ' + p1[anchor]
 							final_cbuffer.append(anchor)
 						else:
 							anchor -= 1
@@ -341,11 +1156,9 @@ class VicinityDrivenSentenceAligner(SentenceAligner):
 				
 				#If edge is not reached, find new starting point to continue the alignment search:
 				if anchor<len(p1):
-					currXY = self.findStartingPoint(matrix, p1, p2, [anchor-1, bestNextXY[1]])
+					currXY = self.findStartingPoint(matrix, p1, p2, [anchor-1, bestNextXY[1]], starting_points)
 					if currXY[0]<len(p1) and currXY[1]<len(p2):
-						cbuffer = p1[currXY[0]]
 						final_cbuffer = [currXY[0]]
-						sbuffer = p2[currXY[1]]
 						final_sbuffer = [currXY[1]]
 				#Otherwise, move along the edge in the opposite axis:
 				else:
@@ -355,17 +1168,15 @@ class VicinityDrivenSentenceAligner(SentenceAligner):
 			elif  bestNextXY[0]==currXY[0] and bestNextXY[1]==currXY[1]+1:
 				#Keep moving rightwards until the alignment stops improving:
 				anchor = bestNextXY[1]+1
-				prevsim = self.similarity_model.getTextSimilarity(cbuffer, sbuffer)
-				sbuffer += ' ' + p2[bestNextXY[1]]
+				prevsim = buffer_similarity.getSimilarity(final_cbuffer, final_sbuffer)
 				final_sbuffer.append(bestNextXY[1])
 				currsim = bestNextXYProb
 				while anchor<len(p2) and currsim>matrix[bestNextXY[0]+1][anchor] and currsim>prevsim-self.similarity_slack:
 					anchor += 1
 					if anchor<len(p2):
 						prevsim = currsim
-						currsim = self.similarity_model.getTextSimilarity(cbuffer, sbuffer+' '+p2[anchor])
+						currsim = buffer_similarity.getSimilarity(final_cbuffer, final_sbuffer+[anchor])
 						if currsim>prevsim-self.similarity_slack and currsim>matrix[bestNextXY[0]+1][anchor]:
-							sbuffer += ' ' + p2[anchor]
 							final_sbuffer.append(anchor)
 						else:
 							anchor -= 1
@@ -374,11 +1185,9 @@ class VicinityDrivenSentenceAligner(SentenceAligner):
 				
 				#If edge is not reached, find new starting point to continue the alignment search:
 				if anchor<len(p2):
-					currXY = self.findStartingPoint(matrix, p1, p2, [bestNextXY[0], anchor-1])
+					currXY = self.findStartingPoint(matrix, p1, p2, [bestNextXY[0], anchor-1], starting_points)
 					if currXY[0]<len(p1) and currXY[1]<len(p2):
-						cbuffer = p1[currXY[0]]
 						final_cbuffer = [currXY[0]]
-						sbuffer = p2[currXY[1]]
 						final_sbuffer = [currXY[1]]
 				#Otherwise, move along the edge in the opposite axis:
 				else:
@@ -389,13 +1198,11 @@ class VicinityDrivenSentenceAligner(SentenceAligner):
 				path.append((final_cbuffer, final_sbuffer))
 				currXY = bestNextXY
 				if bestNextXY[0]<len(p1) and bestNextXY[1]<len(p2):
-					cbuffer = p1[currXY[0]]
 					final_cbuffer = [currXY[0]]
-					sbuffer = p2[currXY[1]]
 					final_sbuffer = [currXY[1]]
 
 		#Continue search from the very edge:
-		if currXY[0]<len(p1) and currXY[1]<len(p2) and self.similarity_model.getTextSimilarity(cbuffer, sbuffer)>self.acceptable_similarity:
+		if currXY[0]<len(p1) and currXY[1]<len(p2) and buffer_similarity.getSimilarity(final_cbuffer, final_sbuffer)>self.acceptable_similarity:
 			#In case last alignment is in the very corner:			
 			if currXY[0]==len(p1)-1 and currXY[1]==len(p2)-1:
 				path.append((final_cbuffer, final_sbuffer))
@@ -403,81 +1210,48 @@ class VicinityDrivenSentenceAligner(SentenceAligner):
 			elif currXY[0]==len(p1)-1:
 				prevsim = -9999
 				anchor = currXY[1]
-				currsim = self.similarity_model.getTextSimilarity(cbuffer, sbuffer)
+				currsim = buffer_similarity.getSimilarity(final_cbuffer, final_sbuffer)
 				while anchor<len(p2) and currsim>=prevsim-self.similarity_slack:
 					if anchor<len(p2)-1:
 						prevsim = currsim
-						currsim = self.similarity_model.getTextSimilarity(cbuffer, sbuffer+' '+p2[anchor+1])
+						currsim = buffer_similarity.getSimilarity(final_cbuffer, final_sbuffer+[anchor+1])
 						if currsim>=prevsim-self.similarity_slack:
-							sbuffer += ' ' + p2[anchor+1]
 							final_sbuffer.append(anchor+1)
 					anchor += 1
 				path.append((final_cbuffer, final_sbuffer))
 			else:
 				prevsim = -9999
 				anchor = currXY[0]
-				currsim = self.similarity_model.getTextSimilarity(cbuffer, sbuffer)
+				currsim = buffer_similarity.getSimilarity(final_cbuffer, final_sbuffer)
 				while anchor<len(p1) and currsim>=prevsim-self.similarity_slack:
 					if anchor<len(p1)-1:
 						prevsim = currsim
-						currsim = self.similarity_model.getTextSimilarity(cbuffer+' '+p1[anchor+1], sbuffer)
+						currsim = buffer_similarity.getSimilarity(final_cbuffer+[anchor+1], final_sbuffer)
 						if currsim>=prevsim-self.similarity_slack:
-							cbuffer += ' ' + p1[anchor+1]
 							final_cbuffer.append(anchor+1)
 					anchor += 1
 				path.append((final_cbuffer, final_sbuffer))
-		return path
 		
-	def findStartingPoint(self, matrix, p1, p2, startpos):
+	def findStartingPoint(self, matrix, p1, p2, startpos, starting_points=None):
 		"""
 		Searches for a coordinate in the similarity matrix from which to start (or recover) the alignment path search.
+		The matrix is searched anti-diagonal by anti-diagonal from the starting position, so the first acceptable pair found is the closest one.
 		
 		* *Parameters*:
 			* **matrix**:  A matrix of dimensions [length(p1),length(p2)] containing a similarity score for each sentence pair.
 			* **p1**: A source paragraph. A paragraph is a list of sentences.
 			* **p2**: A target paragraph. A paragraph is a list of sentences.
 			* **startpos**: The coordinate from which to start the search for the first alignment in the matrix (usually [-1,-1]).
+			* **starting_points**: A StartingPointIndex of the matrix. If None, a new one is created.
 		* *Output*:
 			* **x, y**: The coordinate of the next alignment in the similarity matrix.
 		"""
-		#Start search for starting point:
-		sizec = len(p1)
-		sizes = len(p2)
-		visited = set([])
-		currdist = 0
-		if startpos[0]>-1 and startpos[1]>-1:
-			currdist = startpos[0]+startpos[1]
-		currpos = [int(startpos[0]), int(startpos[1])]
-		found = False
-		reached_end = False
-		
-		#Do a search on a per-distance basis until a good enough pair is found:
-		while not found and not reached_end:
-			if currpos[0]==-1 and currpos[1]==-1:
-				currpos = [0, 0]
-			else:
-				if currpos[0]==0:
-					currdist += 1
-					currpos = [currdist, 0]
-				else:
-					currpos[0] -= 1
-					currpos[1] += 1
-			if (sizec-1, sizes-1) in visited:
-				reached_end = True
-			else:
-				if currpos[0]<sizec and currpos[1]<sizes and matrix[currpos[0],currpos[1]]>=self.acceptable_similarity and matrix[currpos[0],currpos[1]]<1.1:
-					if currpos[0]>=startpos[0] and currpos[1]>=startpos[1]:
-						found = True
-			visited.add((currpos[0], currpos[1]))
-		
-		#If no pairs are similar enough, return last position in the matrix:
-		if reached_end:
-			return [sizec,sizes]
-		#Otherwise, return the position found:
-		else:
-			return currpos
+		#Find the first good enough pair in search order:
+		if starting_points is None:
+			starting_points = StartingPointIndex(matrix, len(p1), len(p2), self.acceptable_similarity)
+		return starting_points.getStartingPoint(startpos)
 			
-	def getBestNextHypothesis(self, matrix, p1, p2, cbuffer, sbuffer, currXY):
+	def getBestNextHypothesis(self, matrix, p1, p2, cbuffer, sbuffer, currXY, buffer_similarity=None, starting_points=None):
 		"""
 		Searches for the next alignment in the alignment matrix.
 		
@@ -485,27 +1259,31 @@ class VicinityDrivenSentenceAligner(SentenceAligner):
 			* **matrix**:  A matrix of dimensions [length(p1),length(p2)] containing a similarity score for each sentence pair.
 			* **p1**: A source paragraph. A paragraph is a list of sentences.
 			* **p2**: A target paragraph. A paragraph is a list of sentences.
-			* **cbuffer**: The concatenation of all aligned sentences in the source side, in case the current alignment is of N-1 kind.
-			* **sbuffer**: The concatenation of all aligned sentences in the target side, in case the current alignment is of 1-N kind.
+			* **cbuffer**: The indexes of all aligned sentences in the source side, in case the current alignment is of N-1 kind.
+			* **sbuffer**: The indexes of all aligned sentences in the target side, in case the current alignment is of 1-N kind.
 			* **currXY**: Current coordinate in the similarity matrix from which to continue the search.
+			* **buffer_similarity**: An object that calculates the similarity between buffers of sentences of p1 and p2. If None, a new one is requested from the similarity model.
+			* **starting_points**: A StartingPointIndex of the matrix, used if no candidate in the vicinity is good enough. If None, a new one is created.
 		* *Output*:
 			* **x, y**: A coordinate in the similarity matrix that represents the next alignment in the alignment path.
 		"""
+		#Get buffer similarity calculator:
+		if buffer_similarity is None:
+			buffer_similarity = self.similarity_model.getBufferSimilarity(p1, p2)
+			
 		#Test diagonal:
 		diag = (currXY[0]+1, currXY[1]+1)
 		diagsim = matrix[currXY[0]+1][currXY[1]+1]
 		prevsim = matrix[currXY[0]][currXY[1]]
 
 		#Test downwards:
-		downText = cbuffer + ' ' + p1[currXY[0]+1]
-		downsim = self.similarity_model.getTextSimilarity(downText, sbuffer)
+		downsim = buffer_similarity.getSimilarity(cbuffer+[currXY[0]+1], sbuffer)
 		down = (currXY[0]+1, currXY[1])
 		if downsim<=prevsim-self.similarity_slack:
 			downsim = 0.0
 
 		#Test rightwards:
-		rightText = sbuffer + ' ' + p2[currXY[1]+1]
-		rightsim = self.similarity_model.getTextSimilarity(cbuffer, rightText)
+		rightsim = buffer_similarity.getSimilarity(cbuffer, sbuffer+[currXY[1]+1])
 		right = (currXY[0], currXY[1]+1)
 		if rightsim<=prevsim-self.similarity_slack:
 			rightsim = 0.0
@@ -523,7 +1301,7 @@ class VicinityDrivenSentenceAligner(SentenceAligner):
 			return coordinate, prob
 		#If not, find another one outside the vicinity:
 		else:
-			newc = self.findStartingPoint(matrix, p1, p2, currXY)
+			newc = self.findStartingPoint(matrix, p1, p2, currXY, starting_points)
 			newp = matrix[newc[0]][newc[1]]
 			return newc, newp
 	
@@ -535,26 +1313,28 @@ class VicinityDrivenSentenceAligner(SentenceAligner):
 			* **p1**: A source paragraph. A paragraph is a list of sentences.
 			* **p2**: A target paragraph. A paragraph is a list of sentences.
 			* **sentence_similarities**: A matrix containing a similarity score between all possible pairs of sentences in the union of p1 and p2. The matrix's height and width are equal and equivalent to the number of distinct sentences present in the union of p1 and p2.
-			* **sentence_indexes**: A map connecting each sentence to its numerical index in the sentence_similarities matrix.
+			* **sentence_indexes**: A map connecting each sentence to its numerical index in the sentence_similarities matrix. If None, sentence_similarities is taken to be a matrix of dimensions [length(p1),length(p2)] indexed by sentence positions.
 		* *Output*:
-			* **matrix**: A similarity matrix with dimensions [length(p1),length(p2)]
+			* **matrix**: A similarity matrix with dimensions [length(p1)+1,length(p2)+1], of which the last row and column are filled with 99999. In banded mode, it is a BandedSimilarityMatrix.
 		"""
-		#Start the creation of the regularized search matrix:
+		#Get the position of each sentence in the similarity matrix:
 		sizec = len(p1)
 		sizes = len(p2)
-		maxsize = np.max([sizec, sizes])
-		final_matrix = np.zeros((maxsize+1, maxsize+1))
-		
-		#Fill regularized search matrix:
-		for i in range(sizec, maxsize+1):
-			for j in range(0, maxsize+1):
-				final_matrix[i][j] = 99999
-		for j in range(sizes, maxsize+1):
-			for i in range(0, maxsize+1):
-				final_matrix[i][j] = 99999
-		for i, s1 in enumerate(p1):
-			for j, s2 in enumerate(p2):
-				final_matrix[i][j] = sentence_similarities[sentence_indexes[s1]][sentence_indexes[s2]]
+		if sentence_indexes is None:
+			rows = np.arange(sizec)
+			columns = np.arange(sizes)
+		else:
+			rows = np.array([sentence_indexes[s1] for s1 in p1], dtype=np.int64)
+			columns = np.array([sentence_indexes[s2] for s2 in p2], dtype=np.int64)
+			
+		#Store only the band around the diagonal for long paragraphs:
+		if self.band_width is not None and 2*self.band_width+1<sizes:
+			return BandedSimilarityMatrix(sentence_similarities, self.band_width, rows, columns)
+		
+		#Create regularized search matrix:
+		final_matrix = np.empty((sizec+1, sizes+1))
+		final_matrix.fill(99999)
+		final_matrix[:sizec, :sizes] = np.asarray(sentence_similarities)[np.ix_(rows, columns)]
 
 		#Return regularized search matrix:
 		return final_matrix
@@ -1,3 +1,5 @@
+import re, multiprocessing
+from collections import deque
 from operator import itemgetter
 from nltk.tree import ParentedTree
 
@@ -21,14 +23,104 @@ SIMOP_LABELS_GROUPS = dict(add=['B-A', 'B-AC', 'I-A', 'I-AC'], delete=['B-D', 'B
 SIMOP_LABELS = ['B-A', 'B-AC', 'B-D', 'B-DC', 'B-M', 'B-MC', 'B-R', 'B-RM', 'B-RW', 'B-RWM',
                 'I-A', 'I-AC', 'I-D', 'I-DC', 'I-M', 'I-MC', 'I-R', 'I-RM', 'I-RW', 'I-RWM']
 
+# the tokens of a bracketed parse tree, as read by nltk: an opening bracket with its optional label, a closing bracket, or a leaf
+PARSE_TOKEN_RE = re.compile(r'\(\s*([^\s()]+)?|\)|([^\s()]+)')
+
+PARSE_READERS = ['nltk', 'flat']
+
+
+# =============================================================================
+# Parse Tree Readers
+# =============================================================================
+
+
+def readBracketedParse(parse):
+    """
+    Reads a constituent parse tree in bracketed format into flat lists, without building an nltk tree.
+
+    * *Parameters*:
+        * **parse**: A string containing the constituent parse tree of a sentence.
+    * *Output*:
+        * **parsed**: A dictionary containing the words in the leaves ('leaves'), the part-of-speech tag of each leaf ('postags'), the node immediately above each leaf ('leaf_nodes'), and the label ('labels'), parent ('parents') and span of leaves ('starts' and 'ends') of each node, with nodes numbered in pre-order.
+    """
+
+    leaves, leaf_nodes = [], []
+    labels, parents, starts, ends = [], [], [], []
+    stack = []
+    closed = False
+    for match in PARSE_TOKEN_RE.finditer(parse):
+        token = match.group(0)
+        if closed:
+            raise ValueError('Unexpected token after the end of the parse tree: ' + token)
+        if token[0] == '(':
+            # open a new node under the current one
+            node = len(labels)
+            labels.append(match.group(1) or '')
+            parents.append(stack[-1] if stack else -1)
+            starts.append(len(leaves))
+            ends.append(len(leaves))
+            stack.append(node)
+        elif token == ')':
+            # close the current node
+            if not stack:
+                raise ValueError('Unbalanced closing bracket in the parse tree.')
+            node = stack.pop()
+            ends[node] = len(leaves)
+            closed = not stack
+        else:
+            # add a leaf to the current node
+            if not stack:
+                raise ValueError('Leaf outside of the parse tree: ' + token)
+            leaves.append(token)
+            leaf_nodes.append(stack[-1])
+
+    if stack or not labels:
+        raise ValueError('Incomplete parse tree.')
+
+    postags = [labels[node] for node in leaf_nodes]
+
+    # return the flat representation of the tree
+    return dict(leaves=leaves, postags=postags, leaf_nodes=leaf_nodes, labels=labels, parents=parents,
+                starts=starts, ends=ends, groups={})
+
+
+# =============================================================================
+# Parallel Annotation Workers
+# =============================================================================
+
+
+_file_annotator = None
+
+
+def _initializeAnnotationWorker(annotator):
+    """
+    Stores the annotator used by a worker process of generateSentenceAnnotationsForFile.
+    """
+    global _file_annotator
+    _file_annotator = annotator
+
+
+def _annotateSentenceChunk(chunk):
+    """
+    Annotates a chunk of sentence pairs in a worker process of generateSentenceAnnotationsForFile.
+    It is a module-level function so that it can be sent to worker processes.
+    """
+    return [_file_annotator._annotateSentencePair(*lines) for lines in chunk]
+
 
 class SentenceAnnotator:
     """
     Implements algorithms for annotating transformation operations between parallel sentences.
+
+    * *Parameters*:
+        * **parse_reader**: The reader used for the constituent parse trees. Values supported: nltk (default), which builds nltk trees, and flat, which uses readBracketedParse. Both produce the same annotations.
     """
 
-    def __init__(self):
+    def __init__(self, parse_reader='nltk'):
+        if parse_reader not in PARSE_READERS:
+            raise ValueError('Unknown parse reader: ' + str(parse_reader))
         self.name = "Sentence Annotator"
+        self.parse_reader = parse_reader
 
     # =============================================================================
     # Main Annotation Functions
@@ -41,16 +133,21 @@ class SentenceAnnotator:
         * *Parameters*:
             * **src**: A list of words corresponding to the tokenized source sentence.
             * **ref**: A list of words corresponding to the tokenized reference sentence.
-            * **aligns**: A string containing the word alignments between source and reference, in Pharaoh format.
+            * **aligns**: A string containing the word alignments between source and reference, in Pharaoh format. It can also be a list of 2-element lists or the indexed alignments produced by _formatWordAlignments.
             * **src_parse**: A string containing the constituent parse tree of the source sentence.
             * **ref_parse**: A string containing the constituent parse tree of the reference sentence.
         * *Output*:
             * **sent_annots**: A dictionary containing the token-level annotations for both source and reference sentences.
         """
 
-        if isinstance(aligns, str) or isinstance(aligns, unicode):
+        # index the word alignments only once for all the labelling passes
+        if not isinstance(aligns, dict):
             aligns = self._formatWordAlignments(aligns)
 
+        # parse the trees only once for all the labelling passes
+        src_parse = self._parseTree(src_parse)
+        ref_parse = self._parseTree(ref_parse)
+
         # token-level delete, add and replace
         src_annots = self._labelDeleteReplace(src, ref, aligns)
         ref_annots = self._labelAddReplace(ref, aligns, src_annots)
@@ -106,28 +203,73 @@ class SentenceAnnotator:
             if verbose:
                 print "Annotating sentence", sent_id, '.'
 
-            # get the aligned sentences and format them
-            src_sent, ref_sent = sents_pair.split('|||')
-            src = src_sent.strip().split(' ')
-            ref = ref_sent.strip().split(' ')
-
-            # get the word alignments pairs
-            aligns_list = self._formatWordAlignments(aligns_pairs)
-
             # get the parsed sentences
             src_parse = parse_file.readline()
             ref_parse = parse_file.readline()
 
             # annotate the simplification operations
-            sent_annots = self.getSentenceAnnotations(src, ref, aligns_list, src_parse, ref_parse)
-
-            sent_annots['id'] = sent_id
+            sent_annots = self._annotateSentencePair(sent_id, sents_pair, aligns_pairs, src_parse, ref_parse)
 
             file_annots.append(sent_annots)
 
         # return the transformations annotations for all the parallel sentences in the file
         return file_annots
 
+    def generateSentenceAnnotationsForFile(self, sents_file, aligns_file, parse_file, processes=None, chunk_size=1000, progress=None):
+        """
+        Annotates all the parallel sentences in a given file in parallel. Each sentence pair appears in a separate line.
+        The sentence pairs are read in chunks, which are annotated by a pool of worker processes. Only a few chunks are read ahead of the annotations produced, so large files are never loaded in memory at once.
+
+        * *Parameters*:
+            * **sents_file**: File containing the parallel sentences. Each line in the file contains a source-reference pair, separated by the character |||.
+            * **aligns_file**: File containing the word alignments between each sentence pair. Each line contains the alignments in Pharaoh format.
+            * **parse_file**: File containing the parse trees of the parallel sentences. Every two lines in the file corresponds to a sentence pair (the first is the source parse and the second the reference parse).
+            * **processes**: The number of worker processes. If None, one per CPU is used. If 1, sentences are annotated in the current process.
+            * **chunk_size**: The number of sentence pairs sent to a worker process at a time.
+            * **progress**: A function called with the number of sentence pairs annotated so far, every time a chunk is finished.
+        * *Output*:
+            * A generator of dictionaries, each of them containing the sentence pair id and the annotations for the corresponding source and reference sentences, in the order of the file.
+        """
+
+        # annotate the sentences in the current process if requested
+        if processes == 1:
+            _initializeAnnotationWorker(self)
+            pool = None
+        else:
+            processes = processes or multiprocessing.cpu_count()
+            pool = multiprocessing.Pool(processes, _initializeAnnotationWorker, (self,))
+
+        try:
+            chunks = self._readSentenceChunks(sents_file, aligns_file, parse_file, chunk_size)
+            pending = deque()
+            reading = True
+            annotated = 0
+            while reading or pending:
+                # keep a few chunks waiting for each worker
+                while reading and len(pending) <= 2 * processes:
+                    chunk = next(chunks, None)
+                    if chunk is None:
+                        reading = False
+                    elif pool is None:
+                        pending.append(_annotateSentenceChunk(chunk))
+                    else:
+                        pending.append(pool.apply_async(_annotateSentenceChunk, (chunk,)))
+
+                # produce the annotations of the oldest chunk, so that they follow the order of the file
+                if pending:
+                    chunk_annots = pending.popleft()
+                    if pool is not None:
+                        chunk_annots = chunk_annots.get()
+                    annotated += len(chunk_annots)
+                    if progress is not None:
+                        progress(annotated)
+                    for sent_annots in chunk_annots:
+                        yield sent_annots
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+
     # =============================================================================
     # Output Functions
     # =============================================================================
@@ -191,24 +333,187 @@ class SentenceAnnotator:
     # Internal Annotation Functions
     # =============================================================================
 
+    def _annotateSentencePair(self, sent_id, sents_pair, aligns_pairs, src_parse, ref_parse):
+        """
+        Annotates a sentence pair given as lines read from the files of getSentenceAnnotationsForFile.
+
+        * *Parameters*:
+            * **sent_id**: The id of the sentence pair.
+            * **sents_pair**: A line containing the source-reference pair, separated by the character |||.
+            * **aligns_pairs**: A line containing the word alignments between the sentence pair, in Pharaoh format.
+            * **src_parse**: A line containing the constituent parse tree of the source sentence.
+            * **ref_parse**: A line containing the constituent parse tree of the reference sentence.
+        * *Output*:
+            * **sent_annots**: A dictionary containing the sentence pair id and the token-level annotations for both source and reference sentences.
+        """
+
+        # get the aligned sentences and format them
+        src_sent, ref_sent = sents_pair.split('|||')
+        src = src_sent.strip().split(' ')
+        ref = ref_sent.strip().split(' ')
+
+        # get the word alignments pairs
+        aligns_list = self._formatWordAlignments(aligns_pairs)
+
+        # annotate the simplification operations
+        sent_annots = self.getSentenceAnnotations(src, ref, aligns_list, src_parse, ref_parse)
+
+        sent_annots['id'] = sent_id
+
+        return sent_annots
+
+    def _readSentenceChunks(self, sents_file, aligns_file, parse_file, chunk_size):
+        """
+        Reads the lines of the files of generateSentenceAnnotationsForFile in chunks of sentence pairs.
+
+        * *Parameters*:
+            * **sents_file**: File containing the parallel sentences.
+            * **aligns_file**: File containing the word alignments between each sentence pair.
+            * **parse_file**: File containing the parse trees of the parallel sentences.
+            * **chunk_size**: The maximum number of sentence pairs in a chunk.
+        * *Output*:
+            * A generator of lists of (sent_id, sents_pair, aligns_pairs, src_parse, ref_parse) tuples.
+        """
+
+        chunk = []
+        sent_id = 0
+        while True:
+            sents_pair = sents_file.readline()
+            aligns_pairs = aligns_file.readline()
+            # stop at the end of the shortest of the two files, as getSentenceAnnotationsForFile does
+            if not sents_pair or not aligns_pairs:
+                break
+            sent_id += 1
+            chunk.append((sent_id, sents_pair, aligns_pairs, parse_file.readline(), parse_file.readline()))
+            if len(chunk) == chunk_size:
+                yield chunk
+                chunk = []
+
+        if chunk:
+            yield chunk
+
+    def _parseTree(self, parse):
+        """
+        Parses a constituent parse tree and precomputes the information about its nodes and leaves used by the labelling passes.
+
+        * *Parameters*:
+            * **parse**: A string containing the constituent parse tree of a sentence. If it is already a parsed tree produced by this function, it is returned unchanged.
+        * *Output*:
+            * **parsed**: A dictionary containing the words in the leaves ('leaves'), the part-of-speech tag of each leaf ('postags'), the node immediately above each leaf ('leaf_nodes'), and the label ('labels'), parent ('parents') and span of leaves ('starts' and 'ends') of each node, with nodes numbered in pre-order.
+        """
+
+        if isinstance(parse, dict):
+            return parse
+
+        if self.parse_reader == 'flat':
+            return readBracketedParse(parse)
+
+        tree = ParentedTree.fromstring(parse)
+
+        # traverse the tree in pre-order, numbering its nodes and leaves
+        leaves, leaf_nodes = [], []
+        labels, parents, starts = [], [], []
+        stack = [(tree, -1)]
+        while stack:
+            subtree, parent = stack.pop()
+            if isinstance(subtree, ParentedTree):
+                node = len(labels)
+                labels.append(subtree.label())
+                parents.append(parent)
+                starts.append(len(leaves))
+                stack.extend([(child, node) for child in reversed(subtree)])
+            else:
+                leaves.append(subtree)
+                leaf_nodes.append(parent)
+
+        # compute the end of the span of each node, visiting the children before their parents
+        ends = list(starts)
+        for leaf_index, node in enumerate(leaf_nodes):
+            ends[node] = leaf_index + 1
+        for node in range(len(labels) - 1, 0, -1):
+            ends[parents[node]] = max(ends[parents[node]], ends[node])
+
+        postags = [labels[node] for node in leaf_nodes]
+
+        # return the flat representation of the tree
+        return dict(leaves=leaves, postags=postags, leaf_nodes=leaf_nodes, labels=labels, parents=parents,
+                    starts=starts, ends=ends, groups={})
+
+    def _getGroupNodes(self, parsed, group_synt_tags):
+        """
+        Finds, for each leaf of a parsed tree, its closest ancestor that identifies a syntactic group, not counting the node immediately above the leaf.
+
+        * *Parameters*:
+            * **parsed**: A parse tree as produced by _parseTree.
+            * **group_synt_tags**: A list of the syntactic labels that identify a group.
+        * *Output*:
+            * **group_nodes**: A list containing, for each leaf, the node of its syntactic group, or -1 if it does not belong to any group.
+        """
+
+        key = tuple(group_synt_tags)
+        if key not in parsed['groups']:
+            labels = parsed['labels']
+            parents = parsed['parents']
+
+            # parents come before their children in pre-order, so each node inherits the group of its parent
+            node_groups = []
+            for node, parent in enumerate(parents):
+                if parent < 0:
+                    node_groups.append(-1)
+                elif labels[parent] in group_synt_tags:
+                    node_groups.append(parent)
+                else:
+                    node_groups.append(node_groups[parent])
+
+            parsed['groups'][key] = [node_groups[node] if node >= 0 else -1 for node in parsed['leaf_nodes']]
+
+        return parsed['groups'][key]
+
     def _formatWordAlignments(self, aligns):
         """
-        Transforms the word alignments given as a string into a list of 2-element lists.
+        Transforms the word alignments given as a string into an indexed structure shared by all the labelling passes.
 
         * *Parameters*:
-            * **aligns**: A string containing the word alignments between source and reference, in Pharaoh format.
+            * **aligns**: A string containing the word alignments between source and reference, in Pharaoh format. It can also be a list of 2-element lists.
         * *Output*:
-            * **aligns_list**: A list of list containing the word alignments
+            * **aligns_index**: A dictionary containing the word alignments as a list of 2-element lists ('links'), and the indexes of the reference tokens aligned to each source token ('src_to_ref') and of the source tokens aligned to each reference token ('ref_to_src'), in the order in which they appear in the alignments.
         """
 
         aligns_list = []
-        if aligns.strip() != '':
-            aligns = aligns.strip().split(' ')
-            # transform them into a list of lists: ['1-1', '2-2', '3-4'] -> [[1, 1], [2, 2], [3, 4]]
-            aligns_list = [list(map(int, p.split('-'))) for p in aligns]
+        if isinstance(aligns, str) or isinstance(aligns, unicode):
+            if aligns.strip() != '':
+                aligns = aligns.strip().split(' ')
+                # transform them into a list of lists: ['1-1', '2-2', '3-4'] -> [[1, 1], [2, 2], [3, 4]]
+                aligns_list = [list(map(int, p.split('-'))) for p in aligns]
+        else:
+            aligns_list = [list(p) for p in aligns]
+
+        # create the adjacency lists of the tokens in both sentences, indexed by token index
+        max_src = max([src_index for src_index, ref_index in aligns_list] + [0])
+        max_ref = max([ref_index for src_index, ref_index in aligns_list] + [0])
+        src_to_ref = [[] for i in range(0, max_src + 1)]
+        ref_to_src = [[] for i in range(0, max_ref + 1)]
+        for src_index, ref_index in aligns_list:
+            src_to_ref[src_index].append(ref_index)
+            ref_to_src[ref_index].append(src_index)
+
+        # return the alignments together with their adjacency lists
+        return dict(links=aligns_list, src_to_ref=src_to_ref, ref_to_src=ref_to_src)
+
+    def _getAlignedIndexes(self, adjacency, token_index):
+        """
+        Retrieves the indexes of the tokens aligned to a given token from one of the adjacency lists produced by _formatWordAlignments.
 
-        # return the alignments as a list of 2-element lists
-        return aligns_list
+        * *Parameters*:
+            * **adjacency**: The adjacency lists of the sentence the token belongs to ('src_to_ref' or 'ref_to_src').
+            * **token_index**: The index of the token.
+        * *Output*:
+            * **aligned_indexes**: A new list containing the indexes of the tokens aligned to the given token.
+        """
+
+        if 0 <= token_index < len(adjacency):
+            return list(adjacency[token_index])
+        return []
 
     def _labelDeleteReplace(self, src, ref, aligns):
         """
@@ -217,7 +522,7 @@ class SentenceAnnotator:
         * *Parameters*:
             * **src**: A list of words corresponding to the tokenized source sentence.
             * **ref**: A list of words corresponding to the tokenized reference sentence.
-            * **aligns**: A list of 2-element lists containing the word alignments between source and reference.
+            * **aligns**: The indexed word alignments between source and reference, as produced by _formatWordAlignments.
         * *Output*:
             * **src_annots**: A dictionary containing token-level annotations for deletions and replacements in the source sentence.
         """
@@ -226,7 +531,7 @@ class SentenceAnnotator:
         for token_index, token_word in enumerate(src, start=1):
             src_token = {'index': token_index, 'word': token_word, 'label': ''}
             # get the indexes of all the words in the reference to which the current token in source is aligned to
-            aligns_list = [ref_index for src_index, ref_index in aligns if src_index == token_index]
+            aligns_list = self._getAlignedIndexes(aligns['src_to_ref'], token_index)
             # check if the token is aligned
             if aligns_list:
                 # check if it has been aligned to only one token and if they are exactly the same
@@ -257,7 +562,7 @@ class SentenceAnnotator:
 
         * *Parameters*:
             * **ref**: A list of words corresponding to the tokenized reference sentence.
-            * **aligns**: A list of 2-element lists containing the word alignments between source and reference.
+            * **aligns**: The indexed word alignments between source and reference, as produced by _formatWordAlignments.
             * **src_annots**: A dictionary containing token-level annotations in the source sentence.
         * *Output*:
             * **ref_annots**: A dictionary containing token-level annotations for additions in the reference sentence.
@@ -267,7 +572,7 @@ class SentenceAnnotator:
         for token_index, token_word in enumerate(ref, start=1):
             ref_token = {'index': token_index, 'word': token_word, 'label': ''}
             # get the indexes of all the tokens in the source to which the current token in reference is aligned
-            aligns_list = [src_index for src_index, ref_index in aligns if ref_index == token_index]
+            aligns_list = self._getAlignedIndexes(aligns['ref_to_src'], token_index)
             # check if the token is aligned
             if aligns_list:
                 # it is the replacement of some word(s) in the source
@@ -277,7 +582,11 @@ class SentenceAnnotator:
                     aligns_list.sort()
                     for i in range(1, len(aligns_list)):  # token 0 already has 'B-R' because of label_delete_replace
                         src_index = aligns_list[i]
-                        src_token = [src_token for src_token in src_annots if src_token['index'] == src_index][0]
+                        # links to tokens outside the source sentence are invalid (index 0 would silently wrap around)
+                        if not 1 <= src_index <= len(src_annots):
+                            raise IndexError('Word alignment ' + str(src_index) + '-' + str(token_index) + ' points outside the source sentence.')
+                        # the tokens in the sentence are 1-indexed, but their position in the array is 0-indexed
+                        src_token = src_annots[src_index - 1]
                         src_token['label'] = 'I-R'
                         src_token['replace'] = []  # token with 'B-R' has all the replacement tokens
             else:
@@ -298,18 +607,20 @@ class SentenceAnnotator:
         * *Parameters*:
             * **src_annots**: A dictionary containing token-level annotations in the source sentence.
             * **ref_annots**: A dictionary containing token-level annotations in the reference sentence.
-            * **src_parse**: A string containing the constituent parse tree of the source sentence.
-            * **ref_parse**: A string containing the constituent parse tree of the reference sentence.
+            * **src_parse**: The constituent parse tree of the source sentence, as a string or as parsed by _parseTree.
+            * **ref_parse**: The constituent parse tree of the reference sentence, as a string or as parsed by _parseTree.
         """
 
+        src_parse = self._parseTree(src_parse)
+        ref_parse = self._parseTree(ref_parse)
+
         for ref_token in ref_annots:
             # check that the token has been labeled as 'add'
             if ref_token['label'] == 'B-A':
                 # find a token in source, with the same index and labeled as 'delete'
-                same_index_in_src = [src_token for src_token in src_annots if
-                                     src_token['index'] == ref_token['index'] and src_token['label'] == 'B-D']
-                if same_index_in_src:  # it is not an empty list
-                    src_token = same_index_in_src[0] # there is always one at the most
+                # the tokens in the sentence are 1-indexed, but their position in the array is 0-indexed
+                if ref_token['index'] <= len(src_annots) and src_annots[ref_token['index'] - 1]['label'] == 'B-D':
+                    src_token = src_annots[ref_token['index'] - 1]
                     # check that both tokens have the same part of speech tag
                     same_postag = self._have_same_postag(src_token['index'], ref_token['index'], src_parse, ref_parse)
                     if same_postag:
@@ -361,9 +672,15 @@ class SentenceAnnotator:
         * *Parameters*:
             * **src_annots**: A dictionary containing token-level annotations in the source sentence.
             * **ref_annots**: A dictionary containing token-level annotations in the reference sentence.
-            * **aligns**: A list of 2-element lists containing the word alignments between source and reference.
+            * **aligns**: The indexed word alignments between source and reference, as produced by _formatWordAlignments.
         """
 
+        # count the number of 'add' and 'rewrite' in the reference before each position
+        adds_before = [0]
+        for ref_token in ref_annots:
+            is_add = ref_token['label'] in ['B-A', 'B-AC', 'I-AC', 'I-A', 'B-RW']
+            adds_before.append(adds_before[-1] + (1 if is_add else 0))
+
         shift_left = 0
         for src_token in src_annots:
             # check if the token has been labeled to be deleted or as part of a replace or rewrite
@@ -371,20 +688,14 @@ class SentenceAnnotator:
                 shift_left += 1
             else:
                 # get its position in the reference (using the word alignments)
-                ref_index_list = [ref_index for src_index, ref_index in aligns if src_index == src_token['index']]
+                ref_index_list = self._getAlignedIndexes(aligns['src_to_ref'], src_token['index'])
                 if ref_index_list:
                     ref_index = ref_index_list[0]
                 else:
                     ref_index = src_token['index']
 
                 # count the number 'add' and 'rewrite' to the reference up until the new position of the source token
-                shift_right = 0
-                for ref_token in ref_annots:
-                    if ref_token['index'] < ref_index:
-                        if ref_token['label'] in ['B-A', 'B-AC', 'I-AC', 'I-A', 'B-RW']:
-                            shift_right += 1
-                    else:
-                        break
+                shift_right = adds_before[min(max(ref_index - 1, 0), len(ref_annots))]
 
                 # check if the token needs to be moved
                 if (src_token['index'] - shift_left + shift_right) != ref_index:
@@ -406,34 +717,29 @@ class SentenceAnnotator:
 
         * *Parameters*:
             * **annots**: A dictionary containing token-level annotations for the sentence.
-            * **parse**: A string containing the constituent parse tree of the sentence.
+            * **parse**: The constituent parse tree of the sentence, as a string or as parsed by _parseTree.
             * **group_synt_tags**: A list of the syntactic labels that identify a group.
             * **old_token_labels**: A list of transformation operation labels to the replaced by new ones.
             * **new_group_label**: A list of transformation operation labels that will be the replacements of the old ones.
             * **majority_percent**: The minimum percentage of tokens in the syntactic group that must have the same old_token_labels for the whole syntactic group to change to the new labels.
         """
-        parse_tree = ParentedTree.fromstring(parse)
+        parsed = self._parseTree(parse)
+        group_nodes = self._getGroupNodes(parsed, group_synt_tags)
         num_tokens = len(annots)
 
         for ptr_token in range(0, num_tokens):
             token = annots[ptr_token]
             if token['label'] in old_token_labels:
-                # get the subtree of the token
-                treepos = parse_tree.leaf_treeposition(token['index'] - 1)
-                subtree = parse_tree[treepos[:-1]]
-
                 # find if it belongs to the specified syntactic group
-                parent = subtree.parent()
-                while parent and parent.label() not in group_synt_tags:
-                    parent = parent.parent()
+                parent = group_nodes[token['index'] - 1]
 
-                if parent:  # the token is inside one of the specified syntactic groups
+                if parent >= 0:  # the token is inside one of the specified syntactic groups
                     # get the index of the first token in the group, according to the parse tree
-                    begin = parse_tree.treepositions('leaves').index(parent.treeposition() + parent.leaf_treeposition(0))
+                    begin = parsed['starts'][parent]
 
                     # count the number of tokens in the group that have been labeled with the same operation
                     with_same_label = 0
-                    group_tokens = parent.leaves()
+                    group_tokens = parsed['leaves'][begin:parsed['ends'][parent]]
                     for gt in group_tokens:
                         if gt == token['word']:  # check if the word in the group has been labeled
                             if token['label'] in old_token_labels:
@@ -487,25 +793,19 @@ class SentenceAnnotator:
         * *Parameters*:
             * **src_index**: The index of the token to compare in the source sentence.
             * **ref_index**: The index of the token to compare in the reference sentence.
-            * **src_parse**: A string containing the constituent parse tree of the source sentence.
-            * **ref_parse**: A string containing the constituent parse tree of the reference sentence.
+            * **src_parse**: The constituent parse tree of the source sentence, as a string or as parsed by _parseTree.
+            * **ref_parse**: The constituent parse tree of the reference sentence, as a string or as parsed by _parseTree.
         * *Output*:
             * **same_postag**: Indicates whether the two tokens have the same part-of-speech tag or not.
         """
 
-        # get the parse trees from the string format
-        src_tree = ParentedTree.fromstring(src_parse)
-        ref_tree = ParentedTree.fromstring(ref_parse)
-
-        # get the part-of-speech tag of the token in the source sentence
-        src_treepos = src_tree.leaf_treeposition(src_index - 1)
-        src_subtree = src_tree[src_treepos[:-1]]
-        src_postag = src_subtree.label()
+        # get the parse trees from the string format, if they have not been parsed yet
+        src_parse = self._parseTree(src_parse)
+        ref_parse = self._parseTree(ref_parse)
 
-        # get the part-of-speech tag of the token in the reference sentence
-        ref_treepos = ref_tree.leaf_treeposition(ref_index - 1)
-        ref_subtree = ref_tree[ref_treepos[:-1]]
-        ref_postag = ref_subtree.label()
+        # get the part-of-speech tags of the tokens in the source and reference sentences
+        src_postag = src_parse['postags'][src_index - 1]
+        ref_postag = ref_parse['postags'][ref_index - 1]
 
         # return whether the two tokens have the same part-of-speech tag or not
         return src_postag == ref_postag
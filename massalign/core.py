@@ -1,17 +1,73 @@
-import os, gensim
+import os, gensim, multiprocessing
 import numpy as np
 from annotators import *
 from aligners import *
 from models import *
 from gui import *
 
+#The aligners used by the worker processes of alignCorpus:
+_corpus_aligners = None
+
+def _initializeCorpusWorker(massaligner, paragraph_aligner, sentence_aligner):
+	"""
+	Stores the aligners used by a worker process of alignCorpus.
+	When processes are forked, the aligners and their similarity models are inherited from the parent process instead of copied.
+	"""
+	global _corpus_aligners
+	_corpus_aligners = (massaligner, paragraph_aligner, sentence_aligner)
+	
+def _alignCorpusDocuments(task):
+	"""
+	Aligns a pair of documents in a worker process of alignCorpus.
+	It is a module-level function so that it can be sent to worker processes.
+	"""
+	index, path1, path2 = task
+	massaligner, paragraph_aligner, sentence_aligner = _corpus_aligners
+	paragraphs1 = massaligner.getParagraphsFromDocument(path1)
+	paragraphs2 = massaligner.getParagraphsFromDocument(path2)
+	return index, massaligner.getDocumentAlignments(paragraphs1, paragraphs2, paragraph_aligner, sentence_aligner)
+
 class MASSAligner:
 	"""
 	A convenience class that allows you to more easily join aligners and annotators.
+	
+	* *Parameters*:
+		* **cache**: An AlignmentCache instance in which to store paragraph, sentence and document alignments, so that they are not calculated again for the same input, aligner parameters and similarity model. If None, nothing is cached.
 	"""
 	
-	def __init__(self):
-		pass
+	def __init__(self, cache=None):
+		self.cache = cache
+		
+	def getCacheKey(self, kind, paragraphs1, paragraphs2, aligners):
+		"""
+		Produces the key of an alignment result in the cache, from a hash of its input, the class and parameters of its aligners and the fingerprints of their similarity models.
+		
+		* *Parameters*:
+			* **kind**: The kind of alignment: "paragraphs", "sentences" or "documents".
+			* **paragraphs1**: The source input of the aligners.
+			* **paragraphs2**: The target input of the aligners.
+			* **aligners**: A list of the aligners that produce the result.
+		* *Output*:
+			* **key**: The key of the result, or None if there is no cache or the result cannot be cached.
+		"""
+		if self.cache is None:
+			return None
+		content = [kind, paragraphs1, paragraphs2]
+		for aligner in aligners:
+			if not hasattr(aligner, 'getParameters'):
+				return None
+			fingerprint = aligner.similarity_model.getFingerprint()
+			if fingerprint is None:
+				return None
+			content.append([aligner.__class__.__name__, aligner.getParameters(), fingerprint])
+		return self.cache.getKey(content)
+		
+	def storeCachedResult(self, key, result):
+		"""
+		Stores an alignment result in the cache, unless it is partial because its search ran out of budget.
+		"""
+		if key is not None and not getattr(result, 'budget_exceeded', False):
+			self.cache.put(key, result)
 		
 	def getParagraphsFromDocument(self, document_path):
 		"""
@@ -69,7 +125,17 @@ class MASSAligner:
 		"""
 		#Employ the paragraph aligner provided to align paragraphs from documents:
 		if len(paragraphs1)>0 and len(paragraphs2)>0:
-			return paragraph_aligner.alignParagraphsFromDocuments(paragraphs1, paragraphs2, **kwargs)
+			#Look for the result in the cache, unless precomputed inputs are given:
+			key = None
+			if len(kwargs)==0:
+				key = self.getCacheKey('paragraphs', paragraphs1, paragraphs2, [paragraph_aligner])
+			if key is not None:
+				result = self.cache.get(key)
+				if result is not None:
+					return result
+			result = paragraph_aligner.alignParagraphsFromDocuments(paragraphs1, paragraphs2, **kwargs)
+			self.storeCachedResult(key, result)
+			return result
 		else:
 			return [], []
 		
@@ -87,10 +153,120 @@ class MASSAligner:
 		"""
 		#Employ the sentence aligner provided to align sentences from paragraphs:
 		if len(paragraph1)>0 and len(paragraph2)>0:
-			return sentence_aligner.alignSentencesFromParagraphs(paragraph1, paragraph2, **kwargs)
+			#Look for the result in the cache, unless precomputed inputs are given:
+			key = None
+			if len(kwargs)==0:
+				key = self.getCacheKey('sentences', paragraph1, paragraph2, [sentence_aligner])
+			if key is not None:
+				result = self.cache.get(key)
+				if result is not None:
+					return result
+			result = sentence_aligner.alignSentencesFromParagraphs(paragraph1, paragraph2, **kwargs)
+			self.storeCachedResult(key, result)
+			return result
 		else:
 			return [], []
 		
+	def getDocumentAlignments(self, paragraphs1=[], paragraphs2=[], paragraph_aligner=None, sentence_aligner=None):
+		"""
+		Extracts paragraph alignments from two lists of paragraphs from comparable documents, then sentence alignments from each pair of aligned paragraphs.
+		The similarities between all sentences of the documents are calculated only once by the sentence aligner's similarity model, and sliced for each pair of aligned paragraphs. If the paragraph aligner uses the same model, its paragraph similarities are reused as well.
+		The outputs are returned in an AlignmentResult, of which the budget_exceeded attribute is True if the paragraph or sentence aligner ran out of budget.
+		
+		* *Parameters*:
+			* **paragraphs1**: A list of source paragraphs. A paragraph is a list of sentences.
+			* **paragraphs2**: A list of target paragraphs. A paragraph is a list of sentences.
+			* **paragraph_aligner**: An instance of a class deriving from ParagraphAligner.
+			* **sentence_aligner**: An instance of a class deriving from SentenceAligner.
+		* *Output*:
+			* **alignments**: The paragraph alignment path produced by the paragraph aligner.
+			* **aligned_paragraphs**: A list containing all pairs of aligned paragraphs.
+			* **sentence_alignments**: A list containing, for each pair of aligned paragraphs, the output of the sentence aligner upon calling the "alignSentencesFromParagraphs" function.
+		"""
+		#Look for the result in the cache:
+		if len(paragraphs1)==0 or len(paragraphs2)==0:
+			return [], [], []
+		key = self.getCacheKey('documents', paragraphs1, paragraphs2, [paragraph_aligner, sentence_aligner])
+		if key is not None:
+			result = self.cache.get(key)
+			if result is not None:
+				return result
+				
+		#Calculate the similarities between the documents once:
+		document_similarities = sentence_aligner.similarity_model.getDocumentSimilarities(paragraphs1, paragraphs2)
+		
+		#Align paragraphs:
+		if paragraph_aligner.similarity_model is sentence_aligner.similarity_model:
+			paragraph_result = self.getParagraphAlignments(paragraphs1, paragraphs2, paragraph_aligner, paragraph_similarities=document_similarities.paragraph_similarities)
+		else:
+			paragraph_result = self.getParagraphAlignments(paragraphs1, paragraphs2, paragraph_aligner)
+		alignments, aligned_paragraphs = paragraph_result
+			
+		#Start a budget of the sentence aligner once for all pairs of aligned paragraphs:
+		kwargs = {}
+		if hasattr(sentence_aligner, 'getBudget'):
+			kwargs['budget'] = sentence_aligner.getBudget()
+		
+		#Align the sentences of each pair of aligned paragraphs:
+		budget_exceeded = getattr(paragraph_result, 'budget_exceeded', False)
+		sentence_alignments = []
+		for node, aligned_paragraph in zip(alignments, aligned_paragraphs):
+			sentence_similarities = document_similarities.getSentenceSimilarities(node[0], node[1])
+			buffer_similarity = document_similarities.getBufferSimilarity(node[0], node[1])
+			sentence_result = self.getSentenceAlignments(aligned_paragraph[0], aligned_paragraph[1], sentence_aligner, sentence_similarities=sentence_similarities, buffer_similarity=buffer_similarity, **kwargs)
+			budget_exceeded = budget_exceeded or getattr(sentence_result, 'budget_exceeded', False)
+			sentence_alignments.append(sentence_result)
+			
+		#Store and return alignments:
+		result = AlignmentResult((alignments, aligned_paragraphs, sentence_alignments), budget_exceeded)
+		self.storeCachedResult(key, result)
+		return result
+		
+	def alignCorpus(self, document_pairs=[], paragraph_aligner=None, sentence_aligner=None, processes=None, ordered=False):
+		"""
+		Aligns the paragraphs and sentences of many pairs of comparable documents in parallel.
+		The pairs are distributed across a pool of worker processes, each of which reads its documents and aligns them with getDocumentAlignments. The aligners are sent to each worker only once, and are inherited without copies where processes are forked.
+		The largest local pairs of documents are aligned first, so that no worker is left with a large pair at the end.
+		
+		* *Parameters*:
+			* **document_pairs**: A list of (source, target) pairs of document paths. Each line of a document represents a sentence and paragraphs are separated by an empty line.
+			* **paragraph_aligner**: An instance of a class deriving from ParagraphAligner.
+			* **sentence_aligner**: An instance of a class deriving from SentenceAligner.
+			* **processes**: The number of worker processes. If None, one per CPU is used. If 1, documents are aligned in the current process.
+			* **ordered**: If True, results are produced in the order of document_pairs. Otherwise, they are produced as soon as they are ready.
+		* *Output*:
+			* A generator of (index, alignments, aligned_paragraphs, sentence_alignments) tuples, in which index is the position of the pair in document_pairs and the rest is the output of getDocumentAlignments.
+		"""
+		#Schedule the largest pairs of documents first. Online documents count as empty, and the sort is stable, so pairs of unknown size keep their order:
+		tasks = [(index, pair[0], pair[1]) for index, pair in enumerate(document_pairs)]
+		tasks.sort(key=lambda task: -(FileReader(task[1]).getSize()+FileReader(task[2]).getSize()))
+		
+		#Align the documents in the current process if requested:
+		if processes==1:
+			_initializeCorpusWorker(self, paragraph_aligner, sentence_aligner)
+			results = (_alignCorpusDocuments(task) for task in tasks)
+			pool = None
+		else:
+			pool = multiprocessing.Pool(processes, _initializeCorpusWorker, (self, paragraph_aligner, sentence_aligner))
+			results = pool.imap_unordered(_alignCorpusDocuments, tasks)
+			
+		#Produce the results, holding back the ones that are ready before their predecessors if they must be ordered:
+		try:
+			pending = {}
+			next_index = 0
+			for index, result in results:
+				if not ordered:
+					yield (index,) + tuple(result)
+					continue
+				pending[index] = result
+				while next_index in pending:
+					yield (next_index,) + tuple(pending.pop(next_index))
+					next_index += 1
+		finally:
+			if pool is not None:
+				pool.terminate()
+				pool.join()
+		
 	def getSentenceAnnotations(self, sentence1='', sentence2='', sentence_annotator=None, **kwargs):
 		"""
 		Produces word-level annotations from two parallel sentences.
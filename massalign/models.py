@@ -1,8 +1,40 @@
 from abc import ABCMeta, abstractmethod
+import os, json, mmap, codecs, multiprocessing, itertools, zlib, hashlib
 import numpy as np
 import gensim
+from scipy import sparse
 from massalign.util import FileReader
 
+def _countDocumentFrequencies(task):
+	"""
+	Counts the document frequencies of the tokens in a shard of a training file.
+	Every line is a document. It is a module-level function so that it can be sent to worker processes.
+	"""
+	path, start, end, stoplist, prune_at = task
+	reader = FileReader(path, stoplist)
+	dfs = {}
+	num_docs = 0
+	num_pos = 0
+	num_nnz = 0
+	for sentence in reader.iterSplitSentences(start, end):
+		tokens = set(sentence)
+		num_docs += 1
+		num_pos += len(sentence)
+		num_nnz += len(tokens)
+		for token in tokens:
+			dfs[token] = dfs.get(token, 0) + 1
+		if prune_at is not None and len(dfs)>prune_at:
+			_pruneDocumentFrequencies(dfs, prune_at//2)
+	return dfs, num_docs, num_pos, num_nnz
+	
+def _pruneDocumentFrequencies(dfs, size):
+	"""
+	Removes all but the size most frequent tokens from a map of document frequencies.
+	"""
+	removed = sorted(dfs.keys(), key=lambda token: (-dfs[token], token))[size:]
+	for token in removed:
+		del dfs[token]
+
 class SimilarityModel:
 
 	__metaclass__ = ABCMeta
@@ -15,6 +47,111 @@ class SimilarityModel:
 	def getSimilarityMapBetweenSentencesOfParagraphs(self, p1, p2):
 		pass
 		
+	def getParagraphOffsets(self, ps):
+		"""
+		Produces the positions at which each paragraph of a list starts in the flat list of all its sentences.
+				
+		* *Parameters*:
+			* **ps**: A list of paragraphs. A paragraph is a list of sentences.
+		* *Output*:
+			* **offsets**: A numpy array of length [length(ps)+1]. The sentences of paragraph i occupy positions offsets[i] to offsets[i+1]-1.
+		"""
+		return np.concatenate(([0], np.cumsum([len(p) for p in ps]))).astype(np.int64)
+		
+	def getBufferSimilarity(self, p1, p2):
+		"""
+		Produces an object that calculates similarities between buffers of sentences from a pair of paragraphs.
+		By default, the sentences in each buffer are concatenated and compared through the model's getTextSimilarity function.
+				
+		* *Parameters*:
+			* **p1**: A source paragraph. A paragraph is a list of sentences.
+			* **p2**: A target paragraph. A paragraph is a list of sentences.
+		* *Output*:
+			* **buffer_similarity**: An object with a getSimilarity function that takes a list of indexes of sentences in p1 and a list of indexes of sentences in p2.
+		"""
+		return TextBufferSimilarity(self, p1, p2)
+		
+	def getFingerprint(self):
+		"""
+		Produces a hash of everything that determines the similarities calculated by the model, so that results obtained with it can be cached.
+		By default, models have no fingerprint, and their results are never cached.
+				
+		* *Output*:
+			* **fingerprint**: A hexadecimal string, or None.
+		"""
+		return None
+		
+	def getLazySimilarityMapBetweenParagraphsOfDocuments(self, p1s, p2s):
+		"""
+		Produces a matrix containing similarity scores between all paragraphs in a pair of paragraph lists, of which the cells are calculated only when they are read.
+		By default, the full matrix is calculated at once.
+				
+		* *Parameters*:
+			* **p1s**: A list of source paragraphs. Each paragraph is a list of sentences.
+			* **p2s**: A list of target paragraphs. Each paragraph is a list of sentences.
+		* *Output*:
+			* **paragraph_similarities**: A matrix of dimensions [length(p1s),length(p2s)] containing a similarity score for each pair of source and target paragraphs.
+		"""
+		return self.getSimilarityMapBetweenParagraphsOfDocuments(p1s, p2s)
+		
+	def getDocumentSimilarities(self, p1s, p2s):
+		"""
+		Produces the similarities between all sentences and all paragraphs of a pair of documents, so that sentence alignment can reuse them for each pair of aligned paragraphs.
+		By default, the sentences of both documents are scored through getSimilarityMapBetweenSentencesOfParagraphs, and the paragraphs through getSimilarityMapBetweenParagraphsOfDocuments.
+				
+		* *Parameters*:
+			* **p1s**: A list of source paragraphs. Each paragraph is a list of sentences.
+			* **p2s**: A list of target paragraphs. Each paragraph is a list of sentences.
+		* *Output*:
+			* **document_similarities**: A DocumentSimilarities instance.
+		"""
+		#Get the similarities between source and target sentences, indexed by their positions:
+		sentences1 = [sent for p in p1s for sent in p]
+		sentences2 = [sent for p in p2s for sent in p]
+		sentence_similarities, sentence_indexes = self.getSimilarityMapBetweenSentencesOfParagraphs(sentences1, sentences2)
+		if sentence_indexes is not None:
+			indexes1 = [sentence_indexes[sent] for sent in sentences1]
+			indexes2 = [sentence_indexes[sent] for sent in sentences2]
+			sentence_similarities = np.asarray(sentence_similarities)[np.ix_(indexes1, indexes2)]
+		
+		#Return similarities:
+		paragraph_similarities = self.getSimilarityMapBetweenParagraphsOfDocuments(p1s, p2s)
+		buffer_similarity = self.getBufferSimilarity(sentences1, sentences2)
+		return DocumentSimilarities(sentence_similarities, paragraph_similarities, buffer_similarity, self.getParagraphOffsets(p1s), self.getParagraphOffsets(p2s))
+		
+	def poolSentenceSimilarities(self, sentence_similarities, offsets1, offsets2, pooling='max', top_k=3):
+		"""
+		Reduces a matrix of similarities between the sentences of two lists of paragraphs to a matrix of similarities between the paragraphs.
+				
+		* *Parameters*:
+			* **sentence_similarities**: A matrix containing a similarity score between each source and target sentence, indexed by their positions.
+			* **offsets1**: The paragraph offsets of the source sentences, as produced by getParagraphOffsets.
+			* **offsets2**: The paragraph offsets of the target sentences, as produced by getParagraphOffsets.
+			* **pooling**: How the sentence similarities of a paragraph pair are reduced: "max" takes their maximum, "mean" their average, and "topk" the average of the top_k highest.
+			* **top_k**: The number of sentence similarities averaged by "topk" pooling.
+		* *Output*:
+			* **paragraph_similarities**: A numpy array of dimensions [length(offsets1)-1,length(offsets2)-1] containing a similarity score for each paragraph pair.
+		"""
+		#Reduce the blocks of all paragraph pairs at once:
+		sentence_similarities = np.asarray(sentence_similarities)
+		if pooling=='max':
+			rows = np.maximum.reduceat(sentence_similarities, offsets1[:-1], axis=0)
+			return np.ascontiguousarray(np.maximum.reduceat(rows, offsets2[:-1], axis=1))
+		elif pooling=='mean':
+			rows = np.add.reduceat(sentence_similarities, offsets1[:-1], axis=0)
+			sums = np.add.reduceat(rows, offsets2[:-1], axis=1)
+			return sums/np.outer(np.diff(offsets1), np.diff(offsets2))
+		elif pooling=='topk':
+			paragraph_similarities = np.zeros((len(offsets1)-1, len(offsets2)-1))
+			for i in range(0, len(offsets1)-1):
+				for j in range(0, len(offsets2)-1):
+					values = sentence_similarities[offsets1[i]:offsets1[i+1], offsets2[j]:offsets2[j+1]].ravel()
+					k = min(top_k, len(values))
+					paragraph_similarities[i][j] = np.mean(np.partition(values, len(values)-k)[len(values)-k:])
+			return paragraph_similarities
+		else:
+			raise ValueError('Unknown pooling method: ' + str(pooling))
+		
 class TFIDFModel(SimilarityModel):
 	"""
 	Implements a typical gensim TFIDF model for MASSAlign.
@@ -22,12 +159,35 @@ class TFIDFModel(SimilarityModel):
 	* *Parameters*:
 		* **input_files**: A set of file paths containing text from which to extract TFIDF weight values.
 		* **stop_list_file**: A path to a file containing a list of stop-words.
+		* **engine**: The engine used to calculate similarities between sentences. Use "gensim" to query a gensim SparseMatrixSimilarity index, or "sparse" to calculate all similarities at once from a sparse matrix of TFIDF vectors.
+		* **rectangular**: If True, similarity maps contain only the scores between source and target sentences, indexed by their positions, instead of scores between all sentences in the union of source and target.
+		* **pooling**: How sentence similarities are reduced to paragraph similarities: "max", "mean" or "topk".
+		* **top_k**: The number of highest sentence similarities averaged by "topk" pooling.
+		* **model_path**: A path to a folder containing a model previously stored with the save function. If provided, the model is loaded from it instead of trained, and input_files and stop_list_file are ignored. Loaded models always use the sparse engine, which produces the same similarities, and so the same alignments, as the gensim engine.
+		* **streaming**: If True, the model is trained by streaming the input files instead of reading them into memory, and document frequencies are counted in parallel over shards of the files.
+		* **processes**: The number of worker processes used for streaming training. If None, one per CPU is used.
+		* **shard_size**: The size in bytes of the shards into which local input files are split for streaming training. If None, each file is a single shard.
+		* **min_df**: The minimum document frequency of a token for it to be kept in the vocabulary by streaming training.
+		* **max_vocab_size**: The maximum number of tokens kept in the vocabulary by streaming training, chosen by document frequency. If None, all tokens are kept.
+		* **prune_at**: The maximum number of distinct tokens counted at once by each shard and by the merge of their counts in streaming training. When exceeded, the least frequent tokens are discarded, so document frequencies become approximate. If None, counts are never pruned and document frequencies are exact.
 	"""
 
-	def __init__(self, input_files=[], stop_list_file=None):
-		reader = FileReader(stop_list_file)
-		self.stoplist = set([line.strip() for line in reader.getRawText().split('\n')])
-		self.tfidf, self.dictionary = self.getTFIDFmodel(input_files)
+	def __init__(self, input_files=[], stop_list_file=None, engine='gensim', rectangular=False, pooling='max', top_k=3, model_path=None, streaming=False, processes=None, shard_size=None, min_df=1, max_vocab_size=None, prune_at=None):
+		self.engine = engine
+		self.rectangular = rectangular
+		self.pooling = pooling
+		self.top_k = top_k
+		self.idf_weights = None
+		self.fingerprint = None
+		if model_path is not None:
+			self.loadTFIDFmodel(model_path)
+		else:
+			reader = FileReader(stop_list_file)
+			self.stoplist = set([line.strip() for line in reader.getRawText().split('\n')])
+			if streaming:
+				self.tfidf, self.dictionary = self.getStreamingTFIDFmodel(input_files, processes, shard_size, min_df, max_vocab_size, prune_at)
+			else:
+				self.tfidf, self.dictionary = self.getTFIDFmodel(input_files)
 		
 	def getTFIDFmodel(self, input_files=[]):
 		"""
@@ -52,6 +212,158 @@ class TFIDFModel(SimilarityModel):
 		
 		#Return tfidf model:
 		return tfidf, dictionary
+		
+	def getStreamingTFIDFmodel(self, input_files=[], processes=None, shard_size=None, min_df=1, max_vocab_size=None, prune_at=None):
+		"""
+		Trains a gensim TFIDF model without holding the training sentences in memory.
+		The input files are split into shards, the document frequencies of each shard are counted in a pool of worker processes, and the partial counts are merged into the final model.
+				
+		* *Parameters*:
+			* **input_files**: A set of file paths containing text from which to extract TFIDF weight values.
+			* **processes**: The number of worker processes. If None, one per CPU is used.
+			* **shard_size**: The size in bytes of the shards into which local files are split. If None, each file is a single shard.
+			* **min_df**: The minimum document frequency of a token for it to be kept in the vocabulary.
+			* **max_vocab_size**: The maximum number of tokens kept in the vocabulary, chosen by document frequency. If None, all tokens are kept.
+			* **prune_at**: The maximum number of distinct tokens counted at once. When exceeded, the least frequent tokens are discarded, so document frequencies become approximate. If None, counts are never pruned and document frequencies are exact.
+		* *Output*:
+			* **tfidf**: A trained gensim models.TfidfModel instance.
+			* **dictionary**: A trained gensim.corpora.Dictionary instance.
+		"""
+		#Split input files into shards:
+		tasks = []
+		for file in input_files:
+			if shard_size is None or file.startswith('http'):
+				tasks.append((file, 0, None, self.stoplist, prune_at))
+			else:
+				size = os.path.getsize(file)
+				for start in range(0, max(size, 1), shard_size):
+					tasks.append((file, start, min(start+shard_size, size), self.stoplist, prune_at))
+		
+		#Count document frequencies of each shard:
+		if processes==1:
+			results = map(_countDocumentFrequencies, tasks)
+			pool = None
+		else:
+			pool = multiprocessing.Pool(processes)
+			results = pool.imap_unordered(_countDocumentFrequencies, tasks)
+		
+		#Merge partial counts, making sure the worker processes are stopped even if a shard fails:
+		dfs = {}
+		num_docs = 0
+		num_pos = 0
+		num_nnz = 0
+		try:
+			for shard_dfs, shard_docs, shard_pos, shard_nnz in results:
+				for token, df in shard_dfs.items():
+					dfs[token] = dfs.get(token, 0) + df
+				num_docs += shard_docs
+				num_pos += shard_pos
+				num_nnz += shard_nnz
+				if prune_at is not None and len(dfs)>prune_at:
+					_pruneDocumentFrequencies(dfs, prune_at//2)
+		finally:
+			if pool is not None:
+				pool.terminate()
+				pool.join()
+		
+		#Prune vocabulary:
+		tokens = sorted([token for token in dfs if dfs[token]>=min_df])
+		if max_vocab_size is not None and len(tokens)>max_vocab_size:
+			tokens = sorted(sorted(tokens, key=lambda token: -dfs[token])[:max_vocab_size])
+		
+		#Build dictionary and train TFIDF model:
+		dictionary = gensim.corpora.Dictionary()
+		dictionary.token2id = dict([(token, termid) for termid, token in enumerate(tokens)])
+		dictionary.dfs = dict([(termid, dfs[token]) for termid, token in enumerate(tokens)])
+		dictionary.num_docs = num_docs
+		dictionary.num_pos = num_pos
+		dictionary.num_nnz = num_nnz
+		tfidf = gensim.models.TfidfModel(dictionary=dictionary)
+		
+		#Return tfidf model:
+		return tfidf, dictionary
+		
+	def save(self, path):
+		"""
+		Stores the model's vocabulary, IDF weights and stop list in a folder, in a binary layout that can be memory-mapped by the loading processes.
+		The vocabulary is stored sorted, as a single block of UTF-8 encoded tokens plus an array of offsets, so that it can be searched without being read into memory.
+		Hashing vocabularies have no tokens, so only their number of feature buckets is stored, and document frequencies and IDF weights are stored per bucket.
+				
+		* *Parameters*:
+			* **path**: A path to the folder in which to store the model. It is created if it does not exist.
+		"""
+		#Get tokens sorted by their UTF-8 encoding:
+		if not os.path.exists(path):
+			os.makedirs(path)
+		info = {'num_docs': int(self.dictionary.num_docs)}
+		if isinstance(self.dictionary, HashingVocabulary):
+			dfs = self.dictionary.getDocumentFrequencies()
+			order = np.arange(0, len(dfs))
+			sorted_tokens = []
+			info['num_features'] = len(dfs)
+		else:
+			if isinstance(self.dictionary, MappedVocabulary):
+				tokens = [self.dictionary.getToken(termid).encode('utf8') for termid in range(0, len(self.dictionary))]
+				dfs = self.dictionary.getDocumentFrequencies()
+			else:
+				tokens = [self.dictionary[termid].encode('utf8') for termid in range(0, len(self.dictionary))]
+				dfs = np.array([self.dictionary.dfs.get(termid, 0) for termid in range(0, len(self.dictionary))])
+			order = sorted(range(0, len(tokens)), key=tokens.__getitem__)
+			sorted_tokens = [tokens[termid] for termid in order]
+		info['num_terms'] = len(dfs)
+		
+		#Store vocabulary:
+		f = open(os.path.join(path, 'vocabulary.bin'), 'wb')
+		f.write(b''.join(sorted_tokens))
+		f.close()
+		offsets = np.concatenate(([0], np.cumsum([len(token) for token in sorted_tokens]))).astype(np.int64)
+		np.save(os.path.join(path, 'offsets.npy'), offsets)
+		
+		#Store document frequencies and IDF weights in the same order as the vocabulary:
+		np.save(os.path.join(path, 'dfs.npy'), dfs[order].astype(np.int64))
+		np.save(os.path.join(path, 'idfs.npy'), np.asarray(self.getIDFWeights())[order].astype(np.float64))
+		
+		#Store stop list and model information:
+		f = codecs.open(os.path.join(path, 'stoplist.txt'), 'w', encoding='utf8')
+		f.write('\n'.join(sorted(self.stoplist)))
+		f.close()
+		f = open(os.path.join(path, 'model.json'), 'w')
+		json.dump(info, f)
+		f.close()
+		
+	def loadTFIDFmodel(self, path):
+		"""
+		Loads a model stored with the save function.
+		Vocabulary, document frequencies and IDF weights are memory-mapped read-only, so that all processes loading the same model share the same pages.
+		Models stored with a hashing vocabulary are restored with a HashingVocabulary of the same number of feature buckets.
+				
+		* *Parameters*:
+			* **path**: A path to the folder in which the model was stored.
+		"""
+		#Read stop list and model information:
+		reader = FileReader(os.path.join(path, 'stoplist.txt'))
+		self.stoplist = set([line.strip() for line in reader.getRawText().split('\n')])
+		f = open(os.path.join(path, 'model.json'))
+		info = json.load(f)
+		f.close()
+		
+		#Map vocabulary and weights:
+		tokens = b''
+		f = open(os.path.join(path, 'vocabulary.bin'), 'rb')
+		if os.path.getsize(os.path.join(path, 'vocabulary.bin'))>0:
+			tokens = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+		f.close()
+		offsets = np.load(os.path.join(path, 'offsets.npy'), mmap_mode='r')
+		dfs = np.load(os.path.join(path, 'dfs.npy'), mmap_mode='r')
+		if 'num_features' in info:
+			self.dictionary = HashingVocabulary(info['num_features'], dfs, info['num_docs'])
+		else:
+			self.dictionary = MappedVocabulary(tokens, offsets, dfs, info['num_docs'])
+		self.idf_weights = np.load(os.path.join(path, 'idfs.npy'), mmap_mode='r')
+		
+		#Loaded models have no gensim TFIDF model, so they score sentences with the sparse engine, which produces the same similarities:
+		self.tfidf = None
+		self.engine = 'sparse'
 	
 	def getSimilarityMapBetweenSentencesOfParagraphs(self, p1, p2):
 		"""
@@ -61,9 +373,13 @@ class TFIDFModel(SimilarityModel):
 			* **p1**: A source paragraph. A paragraph is a list of sentences.
 			* **p2**: A target paragraph. A paragraph is a list of sentences.
 		* *Output*:
-			* **sentence_similarities**: A matrix containing a similarity score between all possible pairs of sentences in the union of p1 and p2. The matrix's height and width are equal and equivalent to the number of distinct sentences present in the union of p1 and p2.
-			* **sentence_indexes**: A map connecting each sentence to its numerical index in the sentence_similarities matrix.
+			* **sentence_similarities**: A matrix containing a similarity score between all possible pairs of sentences in the union of p1 and p2. The matrix's height and width are equal and equivalent to the number of distinct sentences present in the union of p1 and p2. In rectangular mode, it is a matrix of dimensions [length(p1),length(p2)] instead.
+			* **sentence_indexes**: A map connecting each sentence to its numerical index in the sentence_similarities matrix. In rectangular mode, it is None, since the matrix is indexed by sentence positions.
 		"""
+		#In rectangular mode, score only source against target sentences:
+		if self.rectangular:
+			return self.getTFIDFCrossSimilarities(p1, p2), None
+		
 		#Get distinct sentences from paragraphs:
 		sentences = list(self.getSentencesFromParagraph(p1).union(self.getSentencesFromParagraph(p2)))
 		
@@ -81,27 +397,73 @@ class TFIDFModel(SimilarityModel):
 			* **p1s**: A list of source paragraphs. Each paragraph is a list of sentences.
 			* **p2s**: A list of target paragraphs. Each paragraph is a list of sentences.
 		* *Output*:
-			* **paragraph_similarities**: A matrix containing a similarity score between all possible pairs of paragraphs in the union of p1 and p2. The matrix's height and width are equal and equivalent to the number of distinct paragraphs present in the union of p1s and p2s.
+			* **paragraph_similarities**: A numpy array of dimensions [length(p1s),length(p2s)] containing a similarity score for each pair of source and target paragraphs, pooled from the similarities between their sentences.
 		"""
-		#Get distinct sentences from paragraph sets:
-		sentences = list(self.getSentencesFromParagraphs(p1s).union(self.getSentencesFromParagraphs(p2s)))
-
-		#Get TFIDF model controllers:
-		sentence_similarities, sentence_indexes = self.getTFIDFControllers(sentences)
+		#Get the similarities between source and target sentences:
+		if self.rectangular:
+			sentence_similarities = self.getTFIDFCrossSimilarities([sent for p in p1s for sent in p], [sent for p in p2s for sent in p])
+		else:
+			#Get distinct sentences from paragraph sets:
+			sentences = list(self.getSentencesFromParagraphs(p1s).union(self.getSentencesFromParagraphs(p2s)))
+	
+			#Get TFIDF model controllers:
+			sentence_similarities, sentence_indexes = self.getTFIDFControllers(sentences)
+			indexes1 = [sentence_indexes[sent] for p in p1s for sent in p]
+			indexes2 = [sentence_indexes[sent] for p in p2s for sent in p]
+			sentence_similarities = np.asarray(sentence_similarities)[np.ix_(indexes1, indexes2)]
 	
 		#Calculate paragraph similarities:
-		paragraph_similarities = list(np.zeros((len(p1s), len(p2s))))
-		for i, p1 in enumerate(p1s):
-			for j, p2 in enumerate(p2s):
-				values = []
-				for sent1 in p1:
-					for sent2 in p2:
-						values.append(sentence_similarities[sentence_indexes[sent1]][sentence_indexes[sent2]])
-				paragraph_similarities[i][j] = np.max(values)
+		paragraph_similarities = self.poolSentenceSimilarities(sentence_similarities, self.getParagraphOffsets(p1s), self.getParagraphOffsets(p2s), self.pooling, self.top_k)
 				
 		#Return similarity matrix:
 		return paragraph_similarities
 				
+	def getLazySimilarityMapBetweenParagraphsOfDocuments(self, p1s=[], p2s=[]):
+		"""
+		Produces a matrix containing TFIDF similarity scores between all paragraphs in a pair of paragraph lists, of which the cells are calculated only when they are read.
+		Only the TFIDF vectors of the sentences are calculated up front.
+				
+		* *Parameters*:
+			* **p1s**: A list of source paragraphs. Each paragraph is a list of sentences.
+			* **p2s**: A list of target paragraphs. Each paragraph is a list of sentences.
+		* *Output*:
+			* **paragraph_similarities**: A LazyParagraphSimilarities instance of dimensions [length(p1s),length(p2s)].
+		"""
+		vectors1 = self.getTFIDFMatrix([sent for p in p1s for sent in p])
+		vectors2 = self.getTFIDFMatrix([sent for p in p2s for sent in p])
+		return LazyParagraphSimilarities(self, vectors1, vectors2, self.getParagraphOffsets(p1s), self.getParagraphOffsets(p2s), self.pooling, self.top_k, np.float32)
+				
+	def getDocumentSimilarities(self, p1s=[], p2s=[]):
+		"""
+		Produces the TFIDF similarities between all sentences and all paragraphs of a pair of documents, so that sentence alignment can reuse them for each pair of aligned paragraphs.
+		Every sentence is tokenised and weighted only once. Its TFIDF vector is used both for the similarity matrices and for the buffers of the sentence aligner.
+		Sentence similarities are calculated by the engine of the model, so they are the same as those used by getParagraphAlignments and getSentenceAlignments.
+				
+		* *Parameters*:
+			* **p1s**: A list of source paragraphs. Each paragraph is a list of sentences.
+			* **p2s**: A list of target paragraphs. Each paragraph is a list of sentences.
+		* *Output*:
+			* **document_similarities**: A DocumentSimilarities instance.
+		"""
+		#Get the TFIDF vectors of all sentences:
+		sentences1 = [sent for p in p1s for sent in p]
+		sentences2 = [sent for p in p2s for sent in p]
+		vectors1 = self.getTFIDFMatrix(sentences1, normalize=False)
+		vectors2 = self.getTFIDFMatrix(sentences2, normalize=False)
+		
+		#Calculate sentence and paragraph similarities:
+		if self.engine=='sparse':
+			sentence_similarities = self.getCosineSimilarities(self.getNormalizedTFIDFMatrix(vectors1), self.getNormalizedTFIDFMatrix(vectors2))
+		else:
+			sentence_similarities = self.getTFIDFCrossSimilarities(sentences1, sentences2)
+		offsets1 = self.getParagraphOffsets(p1s)
+		offsets2 = self.getParagraphOffsets(p2s)
+		paragraph_similarities = self.poolSentenceSimilarities(sentence_similarities, offsets1, offsets2, self.pooling, self.top_k)
+		
+		#Return similarities:
+		buffer_similarity = BufferSimilarity(self.getVectorsFromTFIDFMatrix(vectors1), self.getVectorsFromTFIDFMatrix(vectors2), np.float32)
+		return DocumentSimilarities(sentence_similarities, paragraph_similarities, buffer_similarity, offsets1, offsets2)
+				
 	def getTFIDFControllers(self, sentences):
 		"""
 		Produces TFIDF similarity scores between all possible pairs of sentences in a list.
@@ -116,21 +478,182 @@ class TFIDFModel(SimilarityModel):
 		sent_indexes = {}
 		for i, s in enumerate(sentences):
 			sent_indexes[s] = i
+		
+		#Calculate all similarities from a single sparse matrix product:
+		if self.engine=='sparse':
+			vectors = self.getTFIDFMatrix(sentences)
+			sentence_similarities = self.getCosineSimilarities(vectors, vectors)
+			return sentence_similarities, sent_indexes
 			
 		#Get similarity querying framework:
 		texts = [[word for word in sentence.split(' ') if word not in self.stoplist] for sentence in sentences]
 		corpus = [self.dictionary.doc2bow(text) for text in texts]
-		index = gensim.similarities.MatrixSimilarity(self.tfidf[corpus])
 		
 		#Create similarity matrix:
-		sentence_similarities = []
-		for j in range(0, len(sentences)):
-			sims = index[self.tfidf[corpus[j]]]
-			sentence_similarities.append(sims)
+		sentence_similarities = self.getGensimSimilarities(corpus, corpus)
 		
 		#Return controllers:
 		return sentence_similarities, sent_indexes
 	
+	def getTFIDFCrossSimilarities(self, sentences1, sentences2):
+		"""
+		Produces TFIDF similarity scores between each sentence in a source list and each sentence in a target list.
+				
+		* *Parameters*:
+			* **sentences1**: A list of source sentences.
+			* **sentences2**: A list of target sentences.
+		* *Output*:
+			* **sentence_similarities**: A matrix of dimensions [length(sentences1),length(sentences2)] containing a similarity score for each pair of source and target sentences.
+		"""
+		#Calculate the source by target block from a single sparse matrix product:
+		if self.engine=='sparse':
+			vectors1 = self.getTFIDFMatrix(sentences1)
+			vectors2 = self.getTFIDFMatrix(sentences2)
+			return self.getCosineSimilarities(vectors1, vectors2)
+		
+		#Index target sentences and query them with the source sentences:
+		corpus1 = [self.dictionary.doc2bow([word for word in sentence.split(' ') if word not in self.stoplist]) for sentence in sentences1]
+		corpus2 = [self.dictionary.doc2bow([word for word in sentence.split(' ') if word not in self.stoplist]) for sentence in sentences2]
+		
+		#Return similarity matrix:
+		return self.getGensimSimilarities(corpus1, corpus2)
+		
+	def getGensimSimilarities(self, corpus1, corpus2):
+		"""
+		Produces the TFIDF similarities between two lists of bag-of-words vectors by querying a gensim index of the target vectors with the source vectors.
+		The index is built in double precision and its scores are rounded to single precision, so that they are the same as those of the sparse engine and of buffer similarities.
+				
+		* *Parameters*:
+			* **corpus1**: A list of source bag-of-words vectors.
+			* **corpus2**: A list of target bag-of-words vectors.
+		* *Output*:
+			* **sentence_similarities**: A numpy array of dimensions [length(corpus1),length(corpus2)].
+		"""
+		if len(corpus1)==0 or len(corpus2)==0:
+			return np.zeros((len(corpus1), len(corpus2)), dtype=np.float32)
+		index = gensim.similarities.SparseMatrixSimilarity(self.tfidf[corpus2], num_features=len(self.dictionary), dtype=np.float64)
+		return index[self.tfidf[corpus1]].astype(np.float32)
+		
+	def getCosineSimilarities(self, vectors1, vectors2):
+		"""
+		Produces the cosine similarities between the rows of two sparse matrices of normalised TFIDF vectors.
+		Scores are rounded to single precision, like those of the gensim engine and of buffer similarities, so that a sentence and a buffer with the same text always score the same.
+				
+		* *Parameters*:
+			* **vectors1**: A scipy.sparse matrix with one normalised source vector per row.
+			* **vectors2**: A scipy.sparse matrix with one normalised target vector per row.
+		* *Output*:
+			* **sentence_similarities**: A numpy array of dimensions [vectors1.shape[0],vectors2.shape[0]].
+		"""
+		return vectors1.dot(vectors2.T).toarray().astype(np.float32)
+	
+	def getTFIDFMatrix(self, sentences, normalize=True):
+		"""
+		Produces a sparse matrix containing the TFIDF vectors of a list of sentences.
+				
+		* *Parameters*:
+			* **sentences**: A list of sentences.
+			* **normalize**: If True, each vector is scaled to unit length, so that the dot product between two rows is their cosine similarity.
+		* *Output*:
+			* **vectors**: A scipy.sparse CSR matrix of dimensions [length(sentences),length(dictionary)] with one TFIDF vector per row.
+		"""
+		#Get term counts of each sentence:
+		indptr = [0]
+		indices = []
+		counts = []
+		for sentence in sentences:
+			bow = self.dictionary.doc2bow([word for word in sentence.split(' ') if word not in self.stoplist])
+			for termid, count in bow:
+				indices.append(termid)
+				counts.append(count)
+			indptr.append(len(indices))
+		indices = np.array(indices, dtype=np.int64)
+		
+		#Weight term counts by their IDF values:
+		data = np.array(counts, dtype=np.float64)*self.getIDFWeights()[indices]
+		vectors = sparse.csr_matrix((data, indices, np.array(indptr, dtype=np.int64)), shape=(len(sentences), len(self.dictionary)))
+		vectors.eliminate_zeros()
+		
+		#Scale vectors to unit length:
+		if normalize:
+			vectors = self.getNormalizedTFIDFMatrix(vectors)
+		
+		#Return vectors:
+		return vectors
+		
+	def getNormalizedTFIDFMatrix(self, vectors):
+		"""
+		Scales each row of a sparse matrix of TFIDF vectors to unit length. Rows of zeros are left unchanged.
+		"""
+		norms = np.sqrt(np.asarray(vectors.multiply(vectors).sum(axis=1)).ravel())
+		norms[norms==0] = 1.0
+		return sparse.csr_matrix(sparse.diags(1.0/norms).dot(vectors))
+		
+	def getIDFWeights(self):
+		"""
+		Produces a dense array containing the IDF weight of each term in the dictionary.
+				
+		* *Output*:
+			* **idf_weights**: A numpy array of length [length(dictionary)], indexed by term id.
+		"""
+		#Gather the IDF weights of the gensim model only once:
+		if self.idf_weights is None and self.tfidf is not None:
+			self.idf_weights = np.zeros(len(self.dictionary))
+			for termid, idf in self.tfidf.idfs.items():
+				self.idf_weights[termid] = idf
+		#Models without a gensim TFIDF model get them from their document frequencies, the same way gensim does:
+		elif self.idf_weights is None:
+			dfs = self.dictionary.getDocumentFrequencies().astype(np.float64)
+			self.idf_weights = np.zeros(len(dfs))
+			self.idf_weights[dfs>0] = np.log2(float(self.dictionary.num_docs)/dfs[dfs>0])
+		return self.idf_weights
+		
+	def addDocuments(self, input_files=[], sentences=[]):
+		"""
+		Updates a trained model with new documents, without retraining it.
+		The document frequencies of the tokens in the new documents are added to the existing ones, new tokens are added to the vocabulary, and the IDF weights are refreshed.
+		Every line of an input file is a document, just as in training.
+				
+		* *Parameters*:
+			* **input_files**: A set of file paths containing the new text. The files are streamed, not read into memory.
+			* **sentences**: A list of new sentences.
+		"""
+		#Stream the new documents:
+		documents = [FileReader(file, self.stoplist).iterSplitSentences() for file in input_files]
+		documents.append([[word for word in sentence.split(' ') if word not in self.stoplist] for sentence in sentences])
+		documents = itertools.chain(*documents)
+		
+		#Update vocabulary and document frequencies:
+		if isinstance(self.dictionary, gensim.corpora.Dictionary):
+			self.dictionary.add_documents(documents, prune_at=None)
+		else:
+			self.dictionary.add_documents(documents)
+		
+		#Refresh IDF weights:
+		if self.tfidf is not None:
+			self.tfidf = gensim.models.TfidfModel(dictionary=self.dictionary)
+		self.idf_weights = None
+		self.fingerprint = None
+	
+	def getFingerprint(self):
+		"""
+		Produces a hash of the vocabulary, IDF weights, stop-words and settings of the model, so that results obtained with it can be cached.
+		It is calculated only once, until documents are added to the model.
+				
+		* *Output*:
+			* **fingerprint**: A hexadecimal string.
+		"""
+		if self.fingerprint is None:
+			digest = hashlib.sha1()
+			digest.update(json.dumps([self.__class__.__name__, self.engine, self.rectangular, self.pooling, self.top_k, sorted(self.stoplist)]).encode('utf8'))
+			if isinstance(self.dictionary, gensim.corpora.Dictionary):
+				digest.update(json.dumps(sorted(self.dictionary.token2id.items())).encode('utf8'))
+			else:
+				digest.update(self.dictionary.getFingerprint().encode('utf8'))
+			digest.update(self.getIDFWeights().tobytes())
+			self.fingerprint = digest.hexdigest()
+		return self.fingerprint
+	
 	def getTextSimilarity(self, buffer1, buffer2):
 		"""
 		Calculates the TFIDF similarity between two buffers containing text.
@@ -141,18 +664,47 @@ class TFIDFModel(SimilarityModel):
 		* *Output*:
 			* **similarity**: The TFIDF similarity between the two buffers of text.
 		"""
+		#Calculate the similarity between sparse vectors:
+		if self.engine=='sparse':
+			vectors = self.getTFIDFMatrix([buffer1, buffer2])
+			return self.getCosineSimilarities(vectors[0], vectors[1])[0,0]
+			
 		#Get bag-of-words vectors:
 		vec1 = self.dictionary.doc2bow(buffer1.split())
 		vec2 = self.dictionary.doc2bow(buffer2.split())
-		corpus = [vec1, vec2]
-		
-		#Get similarity matrix from bag-of-words model:
-		index = gensim.similarities.MatrixSimilarity(self.tfidf[corpus])
 		
 		#Return the similarity between the vectors:
-		sims = index[self.tfidf[vec1]]
-		similarity = sims[1]
-		return similarity
+		return self.getGensimSimilarities([vec1], [vec2])[0,0]
+	
+	def getBufferSimilarity(self, p1, p2):
+		"""
+		Produces an object that calculates TFIDF similarities between buffers of sentences from a pair of paragraphs.
+		The TFIDF vector of each sentence is calculated only once, and the vector of a buffer is the sum of the vectors of its sentences, which is the same vector produced by concatenating them.
+				
+		* *Parameters*:
+			* **p1**: A source paragraph. A paragraph is a list of sentences.
+			* **p2**: A target paragraph. A paragraph is a list of sentences.
+		* *Output*:
+			* **buffer_similarity**: A BufferSimilarity instance whose similarities are rounded to single precision, like the similarity matrices they are compared with.
+		"""
+		return BufferSimilarity(self.getSentenceVectors(p1), self.getSentenceVectors(p2), np.float32)
+		
+	def getSentenceVectors(self, sentences):
+		"""
+		Produces the TFIDF vectors of a list of sentences in the format used by BufferSimilarity.
+				
+		* *Parameters*:
+			* **sentences**: A list of sentences.
+		* *Output*:
+			* **vectors**: A list containing one vector per sentence. Each vector is a dictionary connecting term ids to their TFIDF weights.
+		"""
+		return self.getVectorsFromTFIDFMatrix(self.getTFIDFMatrix(sentences, normalize=False))
+		
+	def getVectorsFromTFIDFMatrix(self, matrix):
+		"""
+		Converts the rows of a sparse matrix of TFIDF vectors to the format used by BufferSimilarity.
+		"""
+		return [dict(zip(matrix.indices[matrix.indptr[i]:matrix.indptr[i+1]], matrix.data[matrix.indptr[i]:matrix.indptr[i+1]])) for i in range(0, matrix.shape[0])]
 	
 	def getSentencesFromParagraphs(self, ps):
 		"""
@@ -184,5 +736,688 @@ class TFIDFModel(SimilarityModel):
 		#Return all distinct sentences from a paragraph:
 		sentences = set(p)
 		return sentences
+
+class EmbeddingModel(SimilarityModel):
+	"""
+	Implements a similarity model based on word embeddings.
+	The vector of a sentence is the sum of the embeddings of its words, optionally weighted by their IDF values, which has the same direction as their average. Similarity maps are calculated with a single product between matrices of normalised sentence vectors.
+	The embeddings are memory-mapped read-only, so all processes that load the same file share the same pages instead of holding copies of them.
 			
+	* *Parameters*:
+		* **vectors_file**: A path to word embeddings stored with gensim's KeyedVectors.save function. The embedding matrix must be stored in a separate file, which gensim does by default for large matrices, so that it can be memory-mapped.
+		* **stop_list_file**: A path to a file containing a list of stop-words. If None, no words are ignored.
+		* **weighting**: How word embeddings are combined: "average" gives every word the same weight, and "idf" weights them by their IDF values in tfidf_model.
+		* **tfidf_model**: A TFIDFModel instance from which to get IDF values when weighting is "idf".
+		* **pooling**: How sentence similarities are reduced to paragraph similarities: "max", "mean" or "topk".
+		* **top_k**: The number of highest sentence similarities averaged by "topk" pooling.
+	"""
+
+	def __init__(self, vectors_file, stop_list_file=None, weighting='average', tfidf_model=None, pooling='max', top_k=3):
+		self.stoplist = set([])
+		if stop_list_file is not None:
+			reader = FileReader(stop_list_file)
+			self.stoplist = set([line.strip() for line in reader.getRawText().split('\n')])
+		self.vectors_file = vectors_file
+		self.keyed_vectors = gensim.models.KeyedVectors.load(vectors_file, mmap='r')
+		if hasattr(self.keyed_vectors, 'key_to_index'):
+			self.word_indexes = self.keyed_vectors.key_to_index
+		else:
+			self.word_indexes = dict([(word, entry.index) for word, entry in self.keyed_vectors.vocab.items()])
+		self.weighting = weighting
+		self.tfidf_model = tfidf_model
+		self.word_weights = {}
+		self.pooling = pooling
+		self.top_k = top_k
+		self.fingerprint = None
+		
+	def getSimilarityMapBetweenSentencesOfParagraphs(self, p1, p2):
+		"""
+		Produces a matrix containing similarity scores between all sentences in a pair of paragraphs.
+				
+		* *Parameters*:
+			* **p1**: A source paragraph. A paragraph is a list of sentences.
+			* **p2**: A target paragraph. A paragraph is a list of sentences.
+		* *Output*:
+			* **sentence_similarities**: A matrix of dimensions [length(p1),length(p2)] containing a similarity score for each pair of source and target sentences.
+			* **sentence_indexes**: Always None, since the matrix is indexed by sentence positions.
+		"""
+		return self.getEmbeddingCrossSimilarities(p1, p2), None
+		
+	def getSimilarityMapBetweenParagraphsOfDocuments(self, p1s=[], p2s=[]):
+		"""
+		Produces a matrix containing similarity scores between all paragraphs in a pair of paragraph lists.
+				
+		* *Parameters*:
+			* **p1s**: A list of source paragraphs. Each paragraph is a list of sentences.
+			* **p2s**: A list of target paragraphs. Each paragraph is a list of sentences.
+		* *Output*:
+			* **paragraph_similarities**: A numpy array of dimensions [length(p1s),length(p2s)] containing a similarity score for each pair of source and target paragraphs, pooled from the similarities between their sentences.
+		"""
+		sentence_similarities = self.getEmbeddingCrossSimilarities([sent for p in p1s for sent in p], [sent for p in p2s for sent in p])
+		return self.poolSentenceSimilarities(sentence_similarities, self.getParagraphOffsets(p1s), self.getParagraphOffsets(p2s), self.pooling, self.top_k)
 		
+	def getLazySimilarityMapBetweenParagraphsOfDocuments(self, p1s=[], p2s=[]):
+		"""
+		Produces a matrix containing similarity scores between all paragraphs in a pair of paragraph lists, of which the cells are calculated only when they are read.
+		Only the vectors of the sentences are calculated up front.
+				
+		* *Parameters*:
+			* **p1s**: A list of source paragraphs. Each paragraph is a list of sentences.
+			* **p2s**: A list of target paragraphs. Each paragraph is a list of sentences.
+		* *Output*:
+			* **paragraph_similarities**: A LazyParagraphSimilarities instance of dimensions [length(p1s),length(p2s)].
+		"""
+		vectors1 = self.getNormalizedVectors(self.getSentenceEmbeddings([sent for p in p1s for sent in p]))
+		vectors2 = self.getNormalizedVectors(self.getSentenceEmbeddings([sent for p in p2s for sent in p]))
+		return LazyParagraphSimilarities(self, vectors1, vectors2, self.getParagraphOffsets(p1s), self.getParagraphOffsets(p2s), self.pooling, self.top_k)
+		
+	def getDocumentSimilarities(self, p1s=[], p2s=[]):
+		"""
+		Produces the embedding similarities between all sentences and all paragraphs of a pair of documents, so that sentence alignment can reuse them for each pair of aligned paragraphs.
+		The vector of every sentence is calculated only once, and used both for the similarity matrices and for the buffers of the sentence aligner.
+				
+		* *Parameters*:
+			* **p1s**: A list of source paragraphs. Each paragraph is a list of sentences.
+			* **p2s**: A list of target paragraphs. Each paragraph is a list of sentences.
+		* *Output*:
+			* **document_similarities**: A DocumentSimilarities instance.
+		"""
+		#Get the vectors of all sentences:
+		vectors1 = self.getSentenceEmbeddings([sent for p in p1s for sent in p])
+		vectors2 = self.getSentenceEmbeddings([sent for p in p2s for sent in p])
+		
+		#Calculate sentence and paragraph similarities:
+		sentence_similarities = np.dot(self.getNormalizedVectors(vectors1), self.getNormalizedVectors(vectors2).T)
+		offsets1 = self.getParagraphOffsets(p1s)
+		offsets2 = self.getParagraphOffsets(p2s)
+		paragraph_similarities = self.poolSentenceSimilarities(sentence_similarities, offsets1, offsets2, self.pooling, self.top_k)
+		
+		#Return similarities:
+		return DocumentSimilarities(sentence_similarities, paragraph_similarities, DenseBufferSimilarity(list(vectors1), list(vectors2)), offsets1, offsets2)
+		
+	def getFingerprint(self):
+		"""
+		Produces a hash of the embedding files, stop-words and settings of the model, so that results obtained with it can be cached.
+		The embeddings are identified by the path, size and modification time of their files, so that the memory-mapped matrix is never read or copied. It is calculated only once.
+				
+		* *Output*:
+			* **fingerprint**: A hexadecimal string.
+		"""
+		if self.fingerprint is None:
+			files = []
+			for path in [self.vectors_file, self.vectors_file + '.vectors.npy']:
+				if os.path.exists(path):
+					status = os.stat(path)
+					files.append([os.path.abspath(path), status.st_size, status.st_mtime])
+			digest = hashlib.sha1()
+			digest.update(json.dumps([self.__class__.__name__, self.weighting, self.pooling, self.top_k, sorted(self.stoplist), files]).encode('utf8'))
+			if self.weighting=='idf':
+				digest.update(self.tfidf_model.getFingerprint().encode('utf8'))
+			self.fingerprint = digest.hexdigest()
+		return self.fingerprint
+		
+	def getEmbeddingCrossSimilarities(self, sentences1, sentences2):
+		"""
+		Produces the cosine similarities between the vectors of each sentence in a source list and each sentence in a target list.
+				
+		* *Parameters*:
+			* **sentences1**: A list of source sentences.
+			* **sentences2**: A list of target sentences.
+		* *Output*:
+			* **sentence_similarities**: A matrix of dimensions [length(sentences1),length(sentences2)] containing a similarity score for each pair of source and target sentences.
+		"""
+		vectors1 = self.getNormalizedVectors(self.getSentenceEmbeddings(sentences1))
+		vectors2 = self.getNormalizedVectors(self.getSentenceEmbeddings(sentences2))
+		return np.dot(vectors1, vectors2.T)
+		
+	def getSentenceEmbeddings(self, sentences):
+		"""
+		Produces the vectors of a list of sentences.
+				
+		* *Parameters*:
+			* **sentences**: A list of sentences.
+		* *Output*:
+			* **vectors**: A numpy array of dimensions [length(sentences),embedding size] with the weighted sum of the word embeddings of each sentence in each row. Sentences without known words get a vector of zeros.
+		"""
+		embeddings = self.keyed_vectors.vectors
+		vectors = np.zeros((len(sentences), embeddings.shape[1]), dtype=np.float64)
+		for i, sentence in enumerate(sentences):
+			words = [word for word in sentence.split(' ') if word not in self.stoplist and word in self.word_indexes]
+			if len(words)>0:
+				weights = np.array([self.getWordWeight(word) for word in words])
+				vectors[i] = np.dot(weights, embeddings[[self.word_indexes[word] for word in words]])
+		return vectors
+		
+	def getWordWeight(self, word):
+		"""
+		Produces the weight of a word's embedding in the vector of a sentence.
+		"""
+		if self.weighting=='average':
+			return 1.0
+		if word not in self.word_weights:
+			bow = self.tfidf_model.dictionary.doc2bow([word])
+			weight = 0.0
+			if len(bow)>0:
+				weight = self.tfidf_model.getIDFWeights()[bow[0][0]]
+			self.word_weights[word] = weight
+		return self.word_weights[word]
+		
+	def getNormalizedVectors(self, vectors):
+		"""
+		Scales each row of a matrix of vectors to unit length. Rows of zeros are left unchanged.
+		"""
+		norms = np.sqrt(np.sum(vectors*vectors, axis=1))
+		norms[norms==0] = 1.0
+		return vectors/norms[:, np.newaxis]
+		
+	def getTextSimilarity(self, buffer1, buffer2):
+		"""
+		Calculates the embedding similarity between two buffers containing text.
+				
+		* *Parameters*:
+			* **buffer1**: A source buffer containing a block of text.
+			* **buffer2**: A target buffer containing a block of text.
+		* *Output*:
+			* **similarity**: The cosine similarity between the vectors of the two buffers of text.
+		"""
+		return self.getEmbeddingCrossSimilarities([buffer1], [buffer2])[0][0]
+		
+	def getBufferSimilarity(self, p1, p2):
+		"""
+		Produces an object that calculates embedding similarities between buffers of sentences from a pair of paragraphs.
+		The vector of each sentence is calculated only once, and the vector of a buffer is the running sum of the vectors of its sentences.
+				
+		* *Parameters*:
+			* **p1**: A source paragraph. A paragraph is a list of sentences.
+			* **p2**: A target paragraph. A paragraph is a list of sentences.
+		* *Output*:
+			* **buffer_similarity**: A DenseBufferSimilarity instance.
+		"""
+		return DenseBufferSimilarity(list(self.getSentenceEmbeddings(p1)), list(self.getSentenceEmbeddings(p2)))
+		
+class HashingTFIDFModel(TFIDFModel):
+	"""
+	Implements a TFIDF model that uses the hashing trick instead of a vocabulary.
+	Tokens are hashed into a fixed number of feature buckets, and IDF weights are kept per bucket, so memory use and the cost of similarity queries depend only on the number of buckets, no matter how many distinct tokens there are in the training data.
+	Similarities are always calculated with the sparse engine.
+	Models can be stored with the save function and loaded back through the model_path parameter of TFIDFModel.
+			
+	* *Parameters*:
+		* **input_files**: A set of file paths containing text from which to extract TFIDF weight values. The files are streamed, not read into memory.
+		* **stop_list_file**: A path to a file containing a list of stop-words.
+		* **num_features**: The number of feature buckets into which tokens are hashed.
+		* **rectangular**: If True, similarity maps contain only the scores between source and target sentences, indexed by their positions.
+		* **pooling**: How sentence similarities are reduced to paragraph similarities: "max", "mean" or "topk".
+		* **top_k**: The number of highest sentence similarities averaged by "topk" pooling.
+	"""
+
+	def __init__(self, input_files=[], stop_list_file=None, num_features=1048576, rectangular=False, pooling='max', top_k=3):
+		self.engine = 'sparse'
+		self.rectangular = rectangular
+		self.pooling = pooling
+		self.top_k = top_k
+		self.idf_weights = None
+		self.fingerprint = None
+		self.tfidf = None
+		reader = FileReader(stop_list_file)
+		self.stoplist = set([line.strip() for line in reader.getRawText().split('\n')])
+		self.dictionary = HashingVocabulary(num_features)
+		self.addDocuments(input_files)
+		
+class HashingVocabulary:
+	"""
+	A vocabulary that can take the place of a gensim Dictionary in a TFIDFModel by hashing tokens into a fixed number of feature buckets.
+	Tokens are hashed with CRC32, so the bucket of a token is the same in every process.
+	Document frequencies loaded from disk are never modified: they are copied into memory before documents are added.
+	
+	* *Parameters*:
+		* **num_features**: The number of feature buckets.
+		* **dfs**: An array containing the document frequency of each feature bucket. If None, all document frequencies start at zero.
+		* **num_docs**: The number of documents from which the document frequencies were collected.
+	"""
+	
+	def __init__(self, num_features, dfs=None, num_docs=0):
+		self.num_features = num_features
+		self.dfs = dfs
+		if self.dfs is None:
+			self.dfs = np.zeros(num_features, dtype=np.int64)
+		self.num_docs = num_docs
+		
+	def __len__(self):
+		return self.num_features
+		
+	def getTokenId(self, token):
+		"""
+		Produces the feature bucket of a token.
+		"""
+		return (zlib.crc32(token.encode('utf8')) & 0xffffffff) % self.num_features
+		
+	def getDocumentFrequencies(self):
+		"""
+		Produces an array containing the document frequency of each feature bucket.
+		"""
+		return self.dfs
+		
+	def getFingerprint(self):
+		"""
+		Produces a hash of the mapping between tokens and ids of the vocabulary.
+		"""
+		return hashlib.sha1(('HashingVocabulary ' + str(self.num_features)).encode('utf8')).hexdigest()
+		
+	def add_documents(self, documents):
+		"""
+		Adds the document frequencies of the feature buckets of a list of documents.
+		"""
+		if not self.dfs.flags.writeable:
+			self.dfs = np.array(self.dfs)
+		for document in documents:
+			self.num_docs += 1
+			for termid in set([self.getTokenId(token) for token in document]):
+				self.dfs[termid] += 1
+			
+	def doc2bow(self, document):
+		"""
+		Produces the bag-of-words vector of a list of words, in the same format as gensim's Dictionary.doc2bow.
+		"""
+		counts = {}
+		for word in document:
+			termid = self.getTokenId(word)
+			counts[termid] = counts.get(termid, 0) + 1
+		return sorted(counts.items())
+		
+class MappedVocabulary:
+	"""
+	A vocabulary that can take the place of a gensim Dictionary in a TFIDFModel loaded from disk.
+	Tokens are kept sorted in a memory-mapped block and found through binary search, so the vocabulary is never copied into the memory of the process.
+	The mapped files are never modified: tokens and document frequencies added later are kept in memory, on top of the mapped ones.
+	
+	* *Parameters*:
+		* **tokens**: A memory-mapped block containing the sorted UTF-8 encoded tokens, one after the other.
+		* **offsets**: An array containing the position of each token in the block, plus the length of the block.
+		* **dfs**: An array containing the document frequency of each token.
+		* **num_docs**: The number of documents from which the document frequencies were collected.
+	"""
+	
+	def __init__(self, tokens, offsets, dfs, num_docs):
+		self.tokens = tokens
+		self.offsets = offsets
+		self.dfs = dfs
+		self.num_docs = num_docs
+		self.token_ids = {}
+		self.added_tokens = []
+		self.added_dfs = {}
+		
+	def __len__(self):
+		return len(self.offsets)-1+len(self.added_tokens)
+		
+	def getToken(self, termid):
+		"""
+		Produces the token with a given id.
+		"""
+		if termid>=len(self.offsets)-1:
+			return self.added_tokens[termid-len(self.offsets)+1]
+		return self.tokens[int(self.offsets[termid]):int(self.offsets[termid+1])].decode('utf8')
+		
+	def getDocumentFrequencies(self):
+		"""
+		Produces an array containing the document frequency of each token, indexed by token id.
+		"""
+		dfs = np.zeros(len(self), dtype=np.int64)
+		dfs[:len(self.offsets)-1] = self.dfs
+		for termid, df in self.added_dfs.items():
+			dfs[termid] += df
+		return dfs
+		
+	def getFingerprint(self):
+		"""
+		Produces a hash of the mapping between tokens and ids of the vocabulary.
+		"""
+		digest = hashlib.sha1()
+		digest.update(self.tokens)
+		digest.update(np.ascontiguousarray(self.offsets).tobytes())
+		digest.update(json.dumps(self.added_tokens).encode('utf8'))
+		return digest.hexdigest()
+		
+	def add_documents(self, documents):
+		"""
+		Adds the tokens and document frequencies of a list of documents, in the same way as gensim's Dictionary.add_documents.
+		"""
+		for document in documents:
+			self.num_docs += 1
+			for token in set(document):
+				termid = self.getTokenId(token)
+				if termid is None:
+					termid = len(self)
+					self.added_tokens.append(token)
+					self.token_ids[token] = termid
+				self.added_dfs[termid] = self.added_dfs.get(termid, 0) + 1
+		
+	def getTokenId(self, token):
+		"""
+		Produces the id of a token, or None if the token is not in the vocabulary.
+		Results are memoised, so each distinct token is only searched for once. Added tokens are always found in the memo.
+		"""
+		if token not in self.token_ids:
+			key = token.encode('utf8')
+			size = len(self.offsets)-1
+			low = 0
+			high = size
+			while low<high:
+				middle = (low+high)//2
+				if self.tokens[int(self.offsets[middle]):int(self.offsets[middle+1])]<key:
+					low = middle+1
+				else:
+					high = middle
+			termid = None
+			if low<size and self.tokens[int(self.offsets[low]):int(self.offsets[low+1])]==key:
+				termid = low
+			self.token_ids[token] = termid
+		return self.token_ids[token]
+		
+	def doc2bow(self, document):
+		"""
+		Produces the bag-of-words vector of a list of words, in the same format as gensim's Dictionary.doc2bow.
+		"""
+		counts = {}
+		for word in document:
+			termid = self.getTokenId(word)
+			if termid is not None:
+				counts[termid] = counts.get(termid, 0) + 1
+		return sorted(counts.items())
+		
+class LazyParagraphSimilarities:
+	"""
+	A matrix of similarities between the paragraphs of two documents that calculates and caches its cells only when they are read.
+	It can be read just like a numpy array, with either m[i][j] or m[i, j]. Reading outside the matrix raises an IndexError.
+	
+	* *Parameters*:
+		* **similarity_model**: The SimilarityModel instance that pools sentence similarities into paragraph similarities.
+		* **vectors1**: A matrix with the normalised vector of each sentence of the source document in a row. It can be a numpy array or a scipy.sparse matrix.
+		* **vectors2**: A matrix with the normalised vector of each sentence of the target document in a row.
+		* **offsets1**: The paragraph offsets of the source sentences, as produced by getParagraphOffsets.
+		* **offsets2**: The paragraph offsets of the target sentences, as produced by getParagraphOffsets.
+		* **pooling**: How sentence similarities are reduced to paragraph similarities: "max", "mean" or "topk".
+		* **top_k**: The number of highest sentence similarities averaged by "topk" pooling.
+		* **dtype**: A numpy scalar type, such as numpy.float32, to which sentence similarities are rounded before they are pooled. If None, they keep the precision of the vectors.
+	"""
+	
+	def __init__(self, similarity_model, vectors1, vectors2, offsets1, offsets2, pooling='max', top_k=3, dtype=None):
+		self.similarity_model = similarity_model
+		self.vectors1 = vectors1
+		self.vectors2 = vectors2
+		self.offsets1 = offsets1
+		self.offsets2 = offsets2
+		self.pooling = pooling
+		self.top_k = top_k
+		self.dtype = dtype
+		self.shape = (len(offsets1)-1, len(offsets2)-1)
+		self.values = np.empty(self.shape)
+		self.values.fill(np.nan)
+		self.computed_region = None
+		
+	def __len__(self):
+		return self.shape[0]
+		
+	def __getitem__(self, key):
+		if isinstance(key, tuple):
+			return self.getSimilarity(key[0], key[1])
+		if key<0 or key>=self.shape[0]:
+			raise IndexError('Paragraph index out of range: ' + str(key))
+		return LazyParagraphSimilarityRow(self, key)
+		
+	def getSimilarity(self, i, j):
+		"""
+		Produces the similarity between a source and a target paragraph, calculating it if it was not read before.
+		"""
+		if i<0 or j<0 or i>=self.shape[0] or j>=self.shape[1]:
+			raise IndexError('Paragraph indexes out of range: ' + str((i, j)))
+		if np.isnan(self.values[i, j]):
+			self.values[i, j] = self.getBlockSimilarities(i, j, i+1, j+1)[0, 0]
+		return self.values[i, j]
+		
+	def getRegion(self, i, j):
+		"""
+		Calculates at once all cells from a given source and target paragraph to the end of the matrix.
+		
+		* *Parameters*:
+			* **i**: The index of the first source paragraph in the region.
+			* **j**: The index of the first target paragraph in the region.
+		* *Output*:
+			* **region**: A numpy array containing the similarities of all cells in the region.
+		"""
+		i = max(i, 0)
+		j = max(j, 0)
+		if self.computed_region is None or i<self.computed_region[0] or j<self.computed_region[1]:
+			self.values[i:, j:] = self.getBlockSimilarities(i, j, self.shape[0], self.shape[1])
+			self.computed_region = (i, j)
+		return self.values[i:, j:]
+		
+	def getBlockSimilarities(self, i1, j1, i2, j2):
+		"""
+		Calculates the similarities between source paragraphs i1 to i2-1 and target paragraphs j1 to j2-1 from a single product between their sentence vectors.
+		"""
+		block = self.vectors1[self.offsets1[i1]:self.offsets1[i2]].dot(self.vectors2[self.offsets2[j1]:self.offsets2[j2]].T)
+		if sparse.issparse(block):
+			block = block.toarray()
+		if self.dtype is not None:
+			block = block.astype(self.dtype)
+		offsets1 = self.offsets1[i1:i2+1]-self.offsets1[i1]
+		offsets2 = self.offsets2[j1:j2+1]-self.offsets2[j1]
+		return self.similarity_model.poolSentenceSimilarities(block, offsets1, offsets2, self.pooling, self.top_k)
+		
+class LazyParagraphSimilarityRow:
+	"""
+	A row of a LazyParagraphSimilarities matrix, so that its cells can be read with m[i][j].
+	"""
+	
+	def __init__(self, matrix, i):
+		self.matrix = matrix
+		self.i = i
+		
+	def __len__(self):
+		return self.matrix.shape[1]
+		
+	def __getitem__(self, j):
+		return self.matrix.getSimilarity(self.i, j)
+		
+class DocumentSimilarities:
+	"""
+	Holds the similarities between the sentences and paragraphs of a pair of documents, and produces the similarities between the sentences of any pair of aligned paragraphs by slicing them.
+	
+	* *Parameters*:
+		* **sentence_similarities**: A matrix containing a similarity score between each source and target sentence of the documents, indexed by their positions.
+		* **paragraph_similarities**: A matrix of dimensions [length(p1s),length(p2s)] containing a similarity score for each paragraph pair.
+		* **buffer_similarity**: An object that calculates the similarity between buffers of sentences of the documents, indexed by their positions. It must implement getSubBufferSimilarity.
+		* **offsets1**: The paragraph offsets of the source sentences, as produced by getParagraphOffsets.
+		* **offsets2**: The paragraph offsets of the target sentences, as produced by getParagraphOffsets.
+	"""
+	
+	def __init__(self, sentence_similarities, paragraph_similarities, buffer_similarity, offsets1, offsets2):
+		self.sentence_similarities = np.asarray(sentence_similarities)
+		self.paragraph_similarities = paragraph_similarities
+		self.buffer_similarity = buffer_similarity
+		self.offsets1 = offsets1
+		self.offsets2 = offsets2
+		
+	def getSentencePositions(self, paragraph_indexes, offsets):
+		"""
+		Produces the positions in the documents of all sentences in a list of paragraphs.
+		"""
+		positions = []
+		for index in paragraph_indexes:
+			positions.extend(range(offsets[index], offsets[index+1]))
+		return positions
+		
+	def getSentenceSimilarities(self, paragraph_indexes1, paragraph_indexes2):
+		"""
+		Produces the similarities between the sentences of an aligned pair of paragraphs.
+		
+		* *Parameters*:
+			* **paragraph_indexes1**: A list of source paragraph indexes, such as the ones in a node of a paragraph alignment path.
+			* **paragraph_indexes2**: A list of target paragraph indexes.
+		* *Output*:
+			* **sentence_similarities**: A numpy array with a similarity score for each source and target sentence of the paragraphs, indexed by their positions in the concatenation of the paragraphs.
+		"""
+		positions1 = self.getSentencePositions(paragraph_indexes1, self.offsets1)
+		positions2 = self.getSentencePositions(paragraph_indexes2, self.offsets2)
+		return self.sentence_similarities[np.ix_(positions1, positions2)]
+		
+	def getBufferSimilarity(self, paragraph_indexes1, paragraph_indexes2):
+		"""
+		Produces an object that calculates similarities between buffers of sentences of an aligned pair of paragraphs, reusing the sentence vectors of the documents.
+		
+		* *Parameters*:
+			* **paragraph_indexes1**: A list of source paragraph indexes, such as the ones in a node of a paragraph alignment path.
+			* **paragraph_indexes2**: A list of target paragraph indexes.
+		* *Output*:
+			* **buffer_similarity**: An object with a getSimilarity function that takes a list of indexes of sentences in the concatenation of each side's paragraphs.
+		"""
+		positions1 = self.getSentencePositions(paragraph_indexes1, self.offsets1)
+		positions2 = self.getSentencePositions(paragraph_indexes2, self.offsets2)
+		return self.buffer_similarity.getSubBufferSimilarity(positions1, positions2)
+		
+class BufferSimilarity:
+	"""
+	Calculates the cosine similarity between buffers of sentences from a pair of paragraphs.
+	The vector of a buffer is the sum of the vectors of its sentences. It is built incrementally from the vector of the buffer without its last sentence, so extending a buffer by one sentence only costs as much as the non-zero entries of that sentence.
+	Buffer vectors, norms and similarities are memoised, so scoring the same pair of buffers again is free.
+	
+	* *Parameters*:
+		* **vectors1**: A list containing one vector per source sentence. Each vector is a dictionary connecting feature ids to weights.
+		* **vectors2**: A list containing one vector per target sentence. Each vector is a dictionary connecting feature ids to weights.
+		* **dtype**: A numpy scalar type, such as numpy.float32, to which similarities are rounded so that they compare with the values of similarity matrices stored with that precision. If None, similarities are Python floats.
+	"""
+	
+	def __init__(self, vectors1, vectors2, dtype=None):
+		self.vectors = [vectors1, vectors2]
+		self.dtype = dtype
+		self.buffers = [{}, {}]
+		self.similarities = {}
+		
+	def getSimilarity(self, indexes1, indexes2):
+		"""
+		Calculates the similarity between a buffer of source sentences and a buffer of target sentences.
+		
+		* *Parameters*:
+			* **indexes1**: A list of indexes of source sentences.
+			* **indexes2**: A list of indexes of target sentences.
+		* *Output*:
+			* **similarity**: The cosine similarity between the buffers.
+		"""
+		key = (tuple(indexes1), tuple(indexes2))
+		if key not in self.similarities:
+			vector1, norm1 = self.getBufferVector(0, key[0])
+			vector2, norm2 = self.getBufferVector(1, key[1])
+			similarity = 0.0
+			if norm1>0 and norm2>0:
+				similarity = self.dot(vector1, vector2)/np.sqrt(norm1*norm2)
+			if self.dtype is not None:
+				similarity = self.dtype(similarity)
+			self.similarities[key] = similarity
+		return self.similarities[key]
+		
+	def getBufferVector(self, side, indexes):
+		"""
+		Produces the vector of a buffer and its squared norm.
+		
+		* *Parameters*:
+			* **side**: 0 for a buffer of source sentences, 1 for a buffer of target sentences.
+			* **indexes**: A tuple of sentence indexes.
+		* *Output*:
+			* **vector**: The sum of the vectors of all sentences in the buffer.
+			* **norm**: The squared norm of the vector.
+		"""
+		buffers = self.buffers[side]
+		if indexes not in buffers:
+			vector = self.vectors[side][indexes[-1]]
+			if len(indexes)==1:
+				buffers[indexes] = (vector, self.dot(vector, vector))
+			else:
+				prefix, prefix_norm = self.getBufferVector(side, indexes[:-1])
+				norm = prefix_norm + 2*self.dot(prefix, vector) + self.dot(vector, vector)
+				buffers[indexes] = (self.add(prefix, vector), norm)
+		return buffers[indexes]
+		
+	def getSubBufferSimilarity(self, indexes1, indexes2):
+		"""
+		Produces a new instance of the same class restricted to some of the source and target sentences, which are renumbered in the order given.
+		"""
+		return self.__class__([self.vectors[0][i] for i in indexes1], [self.vectors[1][i] for i in indexes2], self.dtype)
+		
+	def add(self, vector1, vector2):
+		"""
+		Sums two vectors.
+		"""
+		result = dict(vector1)
+		for key, value in vector2.items():
+			result[key] = result.get(key, 0.0) + value
+		return result
+		
+	def dot(self, vector1, vector2):
+		"""
+		Calculates the dot product between two vectors.
+		"""
+		if len(vector1)>len(vector2):
+			vector1, vector2 = vector2, vector1
+		return float(sum([value*vector2.get(key, 0.0) for key, value in vector1.items()]))
+		
+class DenseBufferSimilarity(BufferSimilarity):
+	"""
+	Calculates the cosine similarity between buffers of sentences from a pair of paragraphs, for sentence vectors stored as numpy arrays.
+	
+	* *Parameters*:
+		* **vectors1**: A list containing one numpy vector per source sentence.
+		* **vectors2**: A list containing one numpy vector per target sentence.
+	"""
+		
+	def add(self, vector1, vector2):
+		"""
+		Sums two vectors.
+		"""
+		return vector1 + vector2
+		
+	def dot(self, vector1, vector2):
+		"""
+		Calculates the dot product between two vectors.
+		"""
+		return float(np.dot(vector1, vector2))
+		
+class TextBufferSimilarity:
+	"""
+	Calculates the similarity between buffers of sentences from a pair of paragraphs by concatenating them and calling the getTextSimilarity function of a similarity model.
+	Similarities are memoised, so scoring the same pair of buffers again is free.
+	
+	* *Parameters*:
+		* **similarity_model**: An instance of a class deriving from SimilarityModel that implements getTextSimilarity.
+		* **p1**: A source paragraph. A paragraph is a list of sentences.
+		* **p2**: A target paragraph. A paragraph is a list of sentences.
+	"""
+	
+	def __init__(self, similarity_model, p1, p2):
+		self.similarity_model = similarity_model
+		self.p1 = p1
+		self.p2 = p2
+		self.similarities = {}
+		
+	def getSimilarity(self, indexes1, indexes2):
+		"""
+		Calculates the similarity between a buffer of source sentences and a buffer of target sentences.
+		
+		* *Parameters*:
+			* **indexes1**: A list of indexes of source sentences.
+			* **indexes2**: A list of indexes of target sentences.
+		* *Output*:
+			* **similarity**: The similarity between the buffers.
+		"""
+		key = (tuple(indexes1), tuple(indexes2))
+		if key not in self.similarities:
+			buffer1 = ' '.join([self.p1[i] for i in indexes1])
+			buffer2 = ' '.join([self.p2[i] for i in indexes2])
+			self.similarities[key] = self.similarity_model.getTextSimilarity(buffer1, buffer2)
+		return self.similarities[key]
+		
+	def getSubBufferSimilarity(self, indexes1, indexes2):
+		"""
+		Produces a new instance restricted to some of the source and target sentences, which are renumbered in the order given.
+		"""
+		return TextBufferSimilarity(self.similarity_model, [self.p1[i] for i in indexes1], [self.p2[i] for i in indexes2])
@@ -1,4 +1,4 @@
-import codecs
+import os, json, time, codecs, hashlib, pickle, sqlite3
 from urllib2 import urlopen
 
 class FileReader:
@@ -30,6 +30,17 @@ class FileReader:
 			f.close()
 		return text
 	
+	def getSize(self):
+		"""
+		Produces the size of the input file without reading it.
+		
+		* *Output*:
+			* **size**: The size of the file in bytes, or 0 if the file is online or does not exist.
+		"""
+		if self.path.startswith('http') or not os.path.isfile(self.path):
+			return 0
+		return os.path.getsize(self.path)
+	
 	def getSplitSentences(self):
 		"""
 		Reads the input file and produces a list of split sentences.
@@ -51,4 +62,184 @@ class FileReader:
 			f.close()
 		return sentences
 		
-	
\ No newline at end of file
+	def iterSplitSentences(self, start=0, end=None):
+		"""
+		Reads the input file one line at a time and produces its split sentences lazily, without holding them in memory.
+		For local files, reading can be restricted to a range of bytes. A line belongs to the range in which it starts.
+		
+		* *Parameters*:
+			* **start**: The position of the first byte of the range.
+			* **end**: The position after the last byte of the range. If None, the file is read until its end.
+		* *Output*:
+			* **sentences**: An iterator over the sentences in the range. Each sentence is a list of words.
+		"""
+		if self.path.startswith('http'):
+			for line in urlopen(self.path):
+				for piece in line.decode('utf8').splitlines():
+					yield [word for word in piece.strip().split(' ') if word not in self.stop_list]
+		else:
+			f = open(self.path, 'rb')
+			if start>0:
+				f.seek(start-1)
+				f.readline()
+			while end is None or f.tell()<end:
+				line = f.readline()
+				if len(line)==0:
+					break
+				for piece in line.decode('utf8').splitlines():
+					yield [word for word in piece.strip().split(' ') if word not in self.stop_list]
+			f.close()
+			
+class AlignmentCache:
+	"""
+	A persistent cache of alignment results stored in an SQLite database, which can be shared by many processes.
+	Each process opens its own connection to the database, which is used in write-ahead logging mode so that readers do not block the writer.
+	When the values stored exceed a maximum size, the least recently read ones are removed in a batch, until the cache is below a fraction of its maximum size.
+	Reads do not write to the database: the times at which values are read are kept by each process and written in batches, when a value is stored or when enough of them are pending. If the database is busy, pending read times are written later.
+	
+	* *Parameters*:
+		* **path**: A path to the database file. It is created if it does not exist.
+		* **max_size**: The maximum total size in bytes of the values stored. If None, values are never removed.
+		* **timeout**: The number of seconds to wait for another process to release the database before failing.
+		* **eviction_ratio**: The fraction of max_size down to which values are removed once the cache exceeds it.
+		* **access_batch**: The number of pending read times after which a process tries to write them to the database.
+	"""
+	
+	def __init__(self, path, max_size=None, timeout=60.0, eviction_ratio=0.9, access_batch=100):
+		self.path = path
+		self.max_size = max_size
+		self.timeout = timeout
+		self.eviction_ratio = eviction_ratio
+		self.access_batch = access_batch
+		self.accessed = {}
+		self.connection = None
+		self.pid = None
+		self.getConnection()
+		
+	def __getstate__(self):
+		#Connections cannot be sent to other processes, so they open their own:
+		state = dict(self.__dict__)
+		state['connection'] = None
+		state['pid'] = None
+		state['accessed'] = {}
+		return state
+		
+	def getConnection(self):
+		"""
+		Produces the connection of the current process to the database, opening it if necessary.
+		Transactions are started explicitly, so the connection is opened in autocommit mode.
+		"""
+		if self.connection is None or self.pid!=os.getpid():
+			self.connection = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+			self.connection.execute('PRAGMA journal_mode=WAL')
+			self.connection.execute('BEGIN IMMEDIATE')
+			self.connection.execute('CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)')
+			self.connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)')
+			#Keep a running total of the size of the values, calculated once for databases that do not have it yet:
+			self.connection.execute('CREATE TABLE IF NOT EXISTS totals (id INTEGER PRIMARY KEY, size INTEGER)')
+			self.connection.execute('INSERT OR IGNORE INTO totals (id, size) SELECT 0, COALESCE(SUM(size), 0) FROM entries')
+			self.connection.execute('COMMIT')
+			self.accessed = {}
+			self.pid = os.getpid()
+		return self.connection
+		
+	def getKey(self, content):
+		"""
+		Produces the key of a value from a hash of the content from which it is produced.
+		
+		* *Parameters*:
+			* **content**: Any structure of lists, dictionaries, strings and numbers that can be encoded as JSON.
+		* *Output*:
+			* **key**: A hexadecimal string.
+		"""
+		return hashlib.sha1(json.dumps(content, sort_keys=True).encode('utf8')).hexdigest()
+		
+	def get(self, key):
+		"""
+		Reads a value from the cache.
+		
+		* *Parameters*:
+			* **key**: The key of the value.
+		* *Output*:
+			* **value**: The value stored, or None if there is none.
+		"""
+		connection = self.getConnection()
+		row = connection.execute('SELECT value FROM entries WHERE key=?', (key,)).fetchone()
+		if row is None:
+			return None
+		
+		#Record the read, and write the pending read times if there are enough of them:
+		self.accessed[key] = time.time()
+		if len(self.accessed)>=self.access_batch:
+			self.flush()
+		return pickle.loads(bytes(row[0]))
+		
+	def flush(self):
+		"""
+		Writes the pending read times of the current process to the database, unless it is busy, in which case they are kept for later.
+		"""
+		if len(self.accessed)==0:
+			return
+		connection = self.getConnection()
+		connection.execute('PRAGMA busy_timeout=0')
+		try:
+			connection.execute('BEGIN IMMEDIATE')
+		except sqlite3.OperationalError:
+			return
+		finally:
+			connection.execute('PRAGMA busy_timeout=' + str(int(self.timeout*1000)))
+		try:
+			self.writeAccessTimes(connection)
+			connection.execute('COMMIT')
+		except Exception:
+			connection.execute('ROLLBACK')
+			raise
+		
+	def writeAccessTimes(self, connection):
+		"""
+		Writes the pending read times of the current process within a transaction.
+		"""
+		connection.executemany('UPDATE entries SET accessed=? WHERE key=? AND accessed<?', [(accessed, key, accessed) for key, accessed in self.accessed.items()])
+		self.accessed = {}
+		
+	def put(self, key, value):
+		"""
+		Stores a value in the cache, together with the pending read times, then removes the least recently read values if the cache exceeds its maximum size.
+		
+		* *Parameters*:
+			* **key**: The key of the value.
+			* **value**: Any value that can be pickled.
+		"""
+		data = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+		connection = self.getConnection()
+		connection.execute('BEGIN IMMEDIATE')
+		try:
+			#Update the running total with the size of the value replaced, if any:
+			row = connection.execute('SELECT size FROM entries WHERE key=?', (key,)).fetchone()
+			previous_size = row[0] if row is not None else 0
+			connection.execute('INSERT OR REPLACE INTO entries (key, value, size, accessed) VALUES (?, ?, ?, ?)', (key, sqlite3.Binary(data), len(data), time.time()))
+			connection.execute('UPDATE totals SET size=size+? WHERE id=0', (len(data)-previous_size,))
+			self.writeAccessTimes(connection)
+			if self.max_size is not None:
+				self.evict(connection)
+			connection.execute('COMMIT')
+		except Exception:
+			connection.execute('ROLLBACK')
+			raise
+		
+	def evict(self, connection):
+		"""
+		Removes the least recently read values within a transaction if the cache exceeds its maximum size, until it does not exceed the eviction ratio of its maximum size.
+		"""
+		total = connection.execute('SELECT size FROM totals WHERE id=0').fetchone()[0]
+		if total<=self.max_size:
+			return
+		target = self.max_size*self.eviction_ratio
+		removed = []
+		for key, size in connection.execute('SELECT key, size FROM entries ORDER BY accessed'):
+			if total<=target:
+				break
+			removed.append((key,))
+			total -= size
+		connection.executemany('DELETE FROM entries WHERE key=?', removed)
+		connection.execute('UPDATE totals SET size=? WHERE id=0', (total,))
@@ -0,0 +1,89 @@
+import os, shutil, tempfile, unittest
+from massalign.core import *
+
+#Paths to the sample documents:
+DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'sample_data')
+DOCUMENTS = [(os.path.join(DATA, 'test_document_complex.txt'), os.path.join(DATA, 'test_document_simple.txt')), (os.path.join(DATA, 'test_document_complex_2.txt'), os.path.join(DATA, 'test_document_simple_2.txt'))]
+STOP_WORDS = os.path.join(DATA, 'stop_words.txt')
+
+class AlignmentConsistencyTest(unittest.TestCase):
+	"""
+	Checks that the different ways of calculating the same similarities produce the same alignments.
+	"""
+	
+	def setUp(self):
+		self.massaligner = MASSAligner()
+		self.input_files = [file for pair in DOCUMENTS for file in pair]
+		self.document_pairs = [(self.massaligner.getParagraphsFromDocument(file1), self.massaligner.getParagraphsFromDocument(file2)) for file1, file2 in DOCUMENTS]
+		
+	def getAlignments(self, model, paragraph_kwargs={}, sentence_kwargs={}, documents=False, document_pairs=None):
+		"""
+		Aligns the paragraphs of every sample document pair, or of the pairs of paragraph lists given, and then the sentences of every pair of aligned paragraphs.
+		If documents is True, both steps are taken at once by getDocumentAlignments.
+		"""
+		paragraph_aligner = VicinityDrivenParagraphAligner(similarity_model=model, acceptable_similarity=0.3, **paragraph_kwargs)
+		sentence_aligner = VicinityDrivenSentenceAligner(similarity_model=model, acceptable_similarity=0.2, similarity_slack=0.05, **sentence_kwargs)
+		alignments = []
+		if document_pairs is None:
+			document_pairs = self.document_pairs
+		for p1s, p2s in document_pairs:
+			if documents:
+				paragraph_alignments, aligned_paragraphs, sentence_alignments = self.massaligner.getDocumentAlignments(p1s, p2s, paragraph_aligner, sentence_aligner)
+				sentence_alignments = [result[0] for result in sentence_alignments]
+			else:
+				paragraph_alignments, aligned_paragraphs = self.massaligner.getParagraphAlignments(p1s, p2s, paragraph_aligner)
+				sentence_alignments = [self.massaligner.getSentenceAlignments(p1, p2, sentence_aligner)[0] for p1, p2 in aligned_paragraphs]
+			alignments.append(self.normalize((paragraph_alignments, sentence_alignments)))
+		return alignments
+		
+	def normalize(self, alignments):
+		"""
+		Converts nested alignments to nested lists of integers, so that they can be compared.
+		"""
+		if isinstance(alignments, (list, tuple)):
+			return [self.normalize(item) for item in alignments]
+		return int(alignments)
+		
+	def testEnginesAgree(self):
+		expected = self.getAlignments(TFIDFModel(self.input_files, STOP_WORDS, engine='gensim'))
+		self.assertEqual(self.getAlignments(TFIDFModel(self.input_files, STOP_WORDS, engine='sparse')), expected)
+		self.assertEqual(self.getAlignments(TFIDFModel(self.input_files, STOP_WORDS, engine='gensim', rectangular=True)), expected)
+		self.assertEqual(self.getAlignments(TFIDFModel(self.input_files, STOP_WORDS, engine='sparse', rectangular=True)), expected)
+		
+	def testDocumentAlignmentsMatchTwoSteps(self):
+		for engine in ['gensim', 'sparse']:
+			model = TFIDFModel(self.input_files, STOP_WORDS, engine=engine)
+			self.assertEqual(self.getAlignments(model, documents=True), self.getAlignments(model))
+			
+	def testReloadedModelsAlignTheSame(self):
+		path = tempfile.mkdtemp()
+		try:
+			model = TFIDFModel(self.input_files, STOP_WORDS)
+			model.save(path)
+			self.assertEqual(self.getAlignments(TFIDFModel(model_path=path)), self.getAlignments(model))
+		finally:
+			shutil.rmtree(path)
+			
+	def testAnchoringMatchesSearch(self):
+		#Insert the same paragraph into both documents, followed by a pair of paragraphs that are not aligned to each other:
+		complex_paragraphs, simple_paragraphs = self.document_pairs[0]
+		anchor = self.document_pairs[1][0][0]
+		document_pairs = [(complex_paragraphs[:1]+[anchor]+complex_paragraphs[1:], simple_paragraphs[:1]+[anchor]+simple_paragraphs[1:])]
+		model = TFIDFModel(self.input_files, STOP_WORDS)
+		expected = self.getAlignments(model, document_pairs=document_pairs)
+		self.assertEqual(self.getAlignments(model, {'anchoring': True}, {'anchoring': True}, document_pairs=document_pairs), expected)
+		self.assertEqual(self.getAlignments(model, {'anchoring': True, 'engine': 'python'}, {'anchoring': True}, document_pairs=document_pairs), expected)
+		
+	def testIdenticalTextScoresTheSame(self):
+		sentences = [sentence for file in self.input_files for p in self.massaligner.getParagraphsFromDocument(file) for sentence in p]
+		for engine in ['gensim', 'sparse']:
+			model = TFIDFModel(self.input_files, STOP_WORDS, engine=engine)
+			similarities = model.getTFIDFCrossSimilarities(sentences, sentences)
+			controllers, indexes = model.getTFIDFControllers(sentences)
+			buffer_similarity = model.getBufferSimilarity(sentences, sentences)
+			for i in range(0, len(sentences)):
+				self.assertEqual(similarities[i][i], buffer_similarity.getSimilarity([i], [i]))
+				self.assertEqual(controllers[i][i], buffer_similarity.getSimilarity([i], [i]))
+				
+if __name__ == '__main__':
+	unittest.main()